@@ -0,0 +1,300 @@
+import os
+import io
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import platform
+import tempfile
+import contextlib
+
+# Times the hot paths of the trainer without a window or Stockfish:
+#   python benchmark.py -o bench.json
+#   python benchmark.py --baseline bench.json --threshold 0.25
+# Runs with SDL's dummy video driver, fake_uci_engine.py and the built-in lines of openings.py
+# indexed in memory, so results do not depend on local book or repertoire files. Prints the
+# results as JSON and exits with 1 when a benchmark got slower than the baseline by more than the threshold.
+
+FAKE_ENGINE = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "fake_uci_engine.py")]
+OPENING = "Ruy Lopez"
+METRICS = ["mean_ms", "p50_ms", "p90_ms", "p99_ms", "max_ms", "per_second"]
+HIGHER_IS_BETTER = {"per_second"}
+
+
+def percentile(ordered, fraction):
+    index = min(int(round(fraction * (len(ordered) - 1))), len(ordered) - 1)
+    return ordered[index]
+
+
+def summarize(samples):
+    # Times in milliseconds, throughput in calls per second
+    ordered = sorted(samples)
+    total = sum(ordered)
+    return {
+        "count": len(ordered),
+        "mean_ms": total / len(ordered) * 1000.0,
+        "p50_ms": percentile(ordered, 0.50) * 1000.0,
+        "p90_ms": percentile(ordered, 0.90) * 1000.0,
+        "p99_ms": percentile(ordered, 0.99) * 1000.0,
+        "max_ms": ordered[-1] * 1000.0,
+        "per_second": len(ordered) / total if total else 0.0,
+    }
+
+
+def measure(function, iterations, setup=None, warmup=3):
+    samples = []
+    for index in range(warmup + iterations):
+        if setup is not None:
+            setup()
+        started = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - started
+        if index >= warmup:
+            samples.append(elapsed)
+    return summarize(samples)
+
+
+def drain_events(trainer):
+    # Engine results that arrived in the meantime are applied like the main loop would
+    import pygame
+    from engine_worker import ENGINE_EVENT
+    for event in pygame.event.get():
+        if event.type == ENGINE_EVENT:
+            trainer.engine_worker.dispatch(event)
+
+
+def reset_session(trainer, leave_book):
+    # A fresh game, optionally played through the book until the engine has taken over
+    from trainer_session import TrainerSession
+    from move_encoding import decode_uci
+
+    trainer.engine_worker.cancel()
+    trainer.session = TrainerSession(trainer.session.opening_book, OPENING, rng=random.Random(0))
+    trainer.board = trainer.session.board
+    trainer.shown_ply = 0
+    trainer.animations.clear()
+    if leave_book:
+        session = trainer.session
+        while True:
+            book_move = session.current_line_move()
+            if book_move is None:
+                break
+            session.play_move(decode_uci(book_move[0]))
+        if session.engine_to_move():
+            session.apply_engine_move(decode_uci(min(session.snapshot.legal_moves)))
+        trainer.shown_ply = trainer.board.ply()
+    trainer.board_surface = trainer.render_board_surface()
+
+
+def check_animation(trainer):
+    # The trainee's book move and the book reply slide one after the other, once both are done
+    # the incrementally drawn board has to match a fresh render of the position
+    import pygame
+    from move_encoding import decode_uci
+    reset_session(trainer, False)
+    trainer.render_scheduler.mark_all()
+    trainer.draw_board()
+    with contextlib.redirect_stdout(io.StringIO()):
+        trainer.process_player_move(decode_uci(trainer.session.current_line_move()[0]))
+    # Frames are drawn like the main loop does, only when something was marked dirty
+    while trainer.animations:
+        trainer.advance_animation()
+        if not trainer.render_scheduler.is_idle():
+            trainer.draw_board()
+    drain_events(trainer)
+    if not trainer.render_scheduler.is_idle():
+        trainer.draw_board()
+
+    board_size = trainer.board_renderer.board_size
+    expected = trainer.render_board_surface()
+    shown = trainer.screen.subsurface((0, 0, board_size, board_size))
+    wrong = []
+    for square in trainer.board.piece_map():
+        rect = trainer.board_renderer.square_rect(square)
+        if pygame.image.tobytes(shown.subsurface(rect), "RGB") != pygame.image.tobytes(expected.subsurface(rect), "RGB"):
+            wrong.append(square)
+    return wrong
+
+
+def run_benchmarks(iterations):
+    import pygame
+    import chess
+    from engine_pool import EnginePool
+    from opening_index import build_opening_index
+    from openings import builtin_openings
+    from trainer_session import PositionSnapshot
+    from move_encoding import decode_uci
+    import main as trainer_module
+
+    pygame.init()
+    results = {}
+    scratch = tempfile.mkdtemp(prefix="pythonchess-bench-")
+    pool = EnginePool(FAKE_ENGINE, size=2)
+    with contextlib.redirect_stdout(io.StringIO()):
+        opening_book = build_opening_index(builtin_openings)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        trainer = trainer_module.ChessTrainer(opening_book, OPENING, pool, journal_path=os.path.join(scratch, "journal.bin"), eval_cache_path=None)
+    trainer.render_scheduler.max_fps = 0  # Frames are timed, not capped
+
+    try:
+        # Timing frames that show the wrong position would be meaningless
+        wrong = check_animation(trainer)
+        if wrong:
+            raise RuntimeError(f"Board differs from a fresh render after the move animations on {', '.join(chess.square_name(square) for square in wrong)}")
+
+        results["render_board_surface"] = measure(trainer.render_board_surface, iterations)
+
+        def draw_full():
+            trainer.render_scheduler.mark_all()
+            trainer.draw_board()
+        results["draw_board_full"] = measure(draw_full, iterations)
+
+        # A wake-up of the main loop when nothing changed: no animation runs and nothing is
+        # marked, so the loop must not draw at all
+        trainer.draw_board()
+        if not trainer.render_scheduler.is_idle():
+            raise RuntimeError("Something is still marked dirty after a frame was drawn")
+
+        def idle_frame():
+            trainer.advance_animation()
+            if not trainer.render_scheduler.is_idle():
+                trainer.draw_board()
+        results["draw_board_idle"] = measure(idle_frame, iterations)
+
+        # Dragging the d2 pawn in a circle, only the sprite's old and new rectangles are redrawn.
+        # check_animation() played 1.e4 e5, a square without a piece would draw no sprite at all
+        square = chess.D2
+        if trainer.board.piece_at(square) is None:
+            raise RuntimeError(f"No piece on {chess.square_name(square)} to drag in {trainer.board.fen()}")
+        positions = [(300 + int(80 * dx), 400 + int(80 * dy)) for dx, dy in ((1, 0), (0.7, 0.7), (0, 1), (-0.7, 0.7), (-1, 0), (-0.7, -0.7), (0, -1), (0.7, -0.7))]
+        frame = [0]
+
+        def draw_dragging():
+            mouse_pos = positions[frame[0] % len(positions)]
+            frame[0] += 1
+            rect = trainer.drag_rect(mouse_pos)
+            trainer.render_scheduler.mark(trainer.last_drag_rect)
+            trainer.render_scheduler.mark(rect)
+            trainer.last_drag_rect = rect
+            trainer.draw_board(None, square, mouse_pos, None)
+        results["draw_board_dragging"] = measure(draw_dragging, iterations)
+
+        # Move generation and game status for every position of the repertoire
+        boards = []
+        for lines in builtin_openings.values():
+            for line in lines:
+                board = chess.Board()
+                for uci_move in line["moves"]:
+                    try:
+                        board.push_uci(uci_move)
+                    except ValueError:
+                        break
+                    boards.append(board.copy(stack=False))
+        boards = boards or [chess.Board()]
+        position = [0]
+
+        def snapshot():
+            board = boards[position[0] % len(boards)]
+            position[0] += 1
+            PositionSnapshot(board)
+        results["legal_moves_and_status"] = measure(snapshot, iterations * 10)
+
+        # The trainee's first book move, including the book reply and the new board surfaces
+        def play_book_move():
+            with contextlib.redirect_stdout(io.StringIO()):
+                trainer.process_player_move(decode_uci(trainer.session.current_line_move()[0]))
+            drain_events(trainer)
+        results["process_player_move_book"] = measure(play_book_move, iterations, setup=lambda: reset_session(trainer, False))
+
+        # A move after the opening, handed to the engine
+        def play_engine_move():
+            with contextlib.redirect_stdout(io.StringIO()):
+                trainer.process_player_move(decode_uci(min(trainer.session.snapshot.legal_moves)))
+            drain_events(trainer)
+        results["process_player_move_engine"] = measure(play_engine_move, iterations, setup=lambda: reset_session(trainer, True))
+        trainer.engine_worker.cancel()
+
+        # Engine round trips: straight through the pool, and through the worker back to the pygame queue
+        board = chess.Board()
+        results["engine_play_round_trip"] = measure(lambda: pool.play(board, {"depth": 1}).result(), iterations)
+
+        def worker_round_trip():
+            from engine_worker import ENGINE_EVENT
+            done = []
+            trainer.engine_worker.submit(lambda engine: trainer_module.get_stockfish_best_move(engine, board), done.append)
+            while not done:
+                event = pygame.event.wait(1000)
+                if event.type == ENGINE_EVENT:
+                    trainer.engine_worker.dispatch(event)
+        results["engine_worker_round_trip"] = measure(worker_round_trip, iterations)
+    finally:
+        with contextlib.redirect_stdout(io.StringIO()):
+            trainer.quit()
+        shutil.rmtree(scratch, ignore_errors=True)
+    return results
+
+
+def compare(results, baseline, metric, threshold):
+    # Benchmarks that are slower than the baseline by more than threshold, for throughput
+    # metrics a lower value is the slowdown
+    regressions = []
+    for name, stats in results.items():
+        before = baseline.get("benchmarks", {}).get(name)
+        if before is None or not before.get(metric) or not stats[metric]:
+            continue
+        if metric in HIGHER_IS_BETTER:
+            change = before[metric] / stats[metric] - 1.0
+        else:
+            change = stats[metric] / before[metric] - 1.0
+        stats["slowdown"] = change
+        if change > threshold:
+            regressions.append((name, before[metric], stats[metric], change))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark rendering, move handling and engine round trips headless.")
+    parser.add_argument("-n", "--iterations", type=int, default=200, help="timed calls per benchmark")
+    parser.add_argument("-o", "--output", help="write the results to this JSON file")
+    parser.add_argument("--baseline", help="JSON results of an earlier run to compare against")
+    parser.add_argument("--metric", default="p50_ms", choices=METRICS, help="statistic compared with the baseline")
+    parser.add_argument("--threshold", type=float, default=0.25, help="allowed slowdown, 0.25 is 25%%")
+    args = parser.parse_args(argv)
+
+    # Must be set before pygame opens its display
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+    import pygame
+    results = run_benchmarks(args.iterations)
+    report = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "pygame": pygame.version.ver,
+        "machine": platform.machine(),
+        "iterations": args.iterations,
+        "benchmarks": results,
+    }
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(results, json.load(f), args.metric, args.threshold)
+        report["regressions"] = [name for name, *_ in regressions]
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    print(text)
+
+    for name, before, after, change in regressions:
+        print(f"Regression in {name}: {args.metric} {before:.3f} -> {after:.3f} ({change:+.0%} slower)", file=sys.stderr)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,227 @@
+import os
+import io
+from collections import OrderedDict
+import pygame
+import chess
+import chess.svg
+
+# Colours taken from chess.svg so the sprite board looks like the old SVG board
+LIGHT_SQUARE_COLOR = (255, 206, 158)  # '#ffce9e'
+DARK_SQUARE_COLOR = (209, 139, 71)  # '#d18b47'
+MARGIN_COLOR = (33, 33, 33)  # '#212121'
+COORD_COLOR = (229, 229, 229)  # '#e5e5e5'
+
+# Order of the pieces inside the atlas, one column per piece
+ATLAS_PIECES = [chess.Piece(piece_type, color) for color in chess.COLORS for piece_type in chess.PIECE_TYPES]
+ATLAS_INDEX = {piece: index for index, piece in enumerate(ATLAS_PIECES)}
+
+DISK_CACHE_SIZES = 4  # Atlas PNGs kept in the cache directory, the least recently used are deleted
+
+
+def rasterize_piece(piece, size):
+    # The only place that still goes through cairosvg, used once per size
+    from cairosvg import svg2png
+    piece_svg = chess.svg.piece(piece, size=size)
+    piece_png = svg2png(bytestring=piece_svg.encode('utf-8'))
+    return pygame.image.load(io.BytesIO(piece_png))
+
+
+def finish_surface(surface):
+    # convert_alpha() needs a display mode, skip it when running without a window
+    if pygame.display.get_init() and pygame.display.get_surface() is not None:
+        return surface.convert_alpha()
+    return surface
+
+
+class SpriteAtlas:
+    # All 12 piece images rasterized once into a single surface of 12 columns
+
+    def __init__(self, size, cache_dir=None):
+        self.size = int(size)
+        self.cache_dir = cache_dir
+        self.surface = self.load() or self.build()
+        self.rects = [pygame.Rect(index * self.size, 0, self.size, self.size) for index in range(len(ATLAS_PIECES))]
+
+    def cache_path(self):
+        if self.cache_dir is None:
+            return None
+        return os.path.join(self.cache_dir, f"pieces_{self.size}.png")
+
+    def load(self):
+        path = self.cache_path()
+        if path is None or not os.path.exists(path):
+            return None
+        try:
+            surface = pygame.image.load(path)
+            os.utime(path)  # The modification time orders the files for prune_cache()
+        except (OSError, pygame.error) as e:
+            print(f"Could not load sprite cache {path}: {e}")
+            return None
+        if surface.get_size() != (self.size * len(ATLAS_PIECES), self.size):
+            return None
+        return finish_surface(surface)
+
+    def prune_cache(self):
+        # Resizing the window passes through many sizes, only the newest few stay on disk
+        try:
+            paths = [os.path.join(self.cache_dir, name) for name in os.listdir(self.cache_dir)
+                     if name.startswith("pieces_") and name.endswith(".png")]
+            paths.sort(key=os.path.getmtime, reverse=True)
+            for path in paths[DISK_CACHE_SIZES:]:
+                os.remove(path)
+        except OSError as e:
+            print(f"Could not prune sprite cache {self.cache_dir}: {e}")
+
+    def build(self):
+        surface = pygame.Surface((self.size * len(ATLAS_PIECES), self.size), pygame.SRCALPHA)
+        for index, piece in enumerate(ATLAS_PIECES):
+            image = rasterize_piece(piece, self.size)
+            if image.get_size() != (self.size, self.size):
+                image = pygame.transform.scale(image, (self.size, self.size))
+            surface.blit(image, (index * self.size, 0))
+
+        path = self.cache_path()
+        if path is not None:
+            try:
+                os.makedirs(self.cache_dir, exist_ok=True)
+                pygame.image.save(surface, path)
+            except (OSError, pygame.error) as e:
+                print(f"Could not write sprite cache {path}: {e}")
+            self.prune_cache()
+        return finish_surface(surface)
+
+    def blit_piece(self, target, piece, pos):
+        target.blit(self.surface, pos, self.rects[ATLAS_INDEX[piece]])
+
+
+def board_geometry(board_size, margin_ratio):
+    # Exact square to pixel mapping: 8 squares of a whole number of pixels, the margin
+    # on each side takes what is left so the board stays centred
+    square_size = int(board_size * (1 - 2 * margin_ratio)) // 8
+    margin = (int(board_size) - 8 * square_size) // 2
+    return margin, square_size
+
+
+class BoardRenderer:
+    # Builds the board by blitting the cached squares and piece sprites. Backgrounds and
+    # sprite atlases are kept per size, so resizing back and forth rasterizes nothing twice.
+
+    def __init__(self, board_size, margin_ratio, cache_dir=None, max_sizes=3):
+        self.margin_ratio = margin_ratio
+        self.cache_dir = cache_dir
+        self.max_sizes = max_sizes  # Sizes kept in memory, the least recently used is dropped
+        self.atlases = OrderedDict()  # square size -> SpriteAtlas
+        self.backgrounds = OrderedDict()  # board size -> Surface
+        self.resize(board_size)
+
+    def cached(self, entries, key, build):
+        value = entries.get(key)
+        if value is None:
+            value = build()
+            entries[key] = value
+        entries.move_to_end(key)
+        while len(entries) > self.max_sizes:
+            entries.popitem(last=False)
+        return value
+
+    def resize(self, board_size):
+        # Returns False when the board keeps its size
+        board_size = int(board_size)
+        if getattr(self, "board_size", None) == board_size:
+            return False
+        self.board_size = board_size
+        self.margin, self.square_size = board_geometry(board_size, self.margin_ratio)
+        self.atlas = self.cached(self.atlases, self.square_size, lambda: SpriteAtlas(self.square_size, self.cache_dir))
+        self.background = self.cached(self.backgrounds, board_size, self.build_background)
+        self.surface = pygame.Surface((board_size, board_size))
+        return True
+
+    def square_rect(self, square):
+        col = chess.square_file(square)
+        row = 7 - chess.square_rank(square)
+        return pygame.Rect(self.margin + col * self.square_size, self.margin + row * self.square_size, self.square_size, self.square_size)
+
+    def square_at(self, pos):
+        # The square under a pixel of the board, None in the margin or outside the board
+        col = (pos[0] - self.margin) // self.square_size
+        row = (pos[1] - self.margin) // self.square_size
+        if 0 <= col < 8 and 0 <= row < 8:
+            return chess.square(int(col), 7 - int(row))
+        return None
+
+    def build_background(self):
+        background = pygame.Surface((self.board_size, self.board_size))
+        background.fill(MARGIN_COLOR)
+
+        for square in chess.SQUARES:
+            light = (chess.square_file(square) + chess.square_rank(square)) % 2 == 1
+            background.fill(LIGHT_SQUARE_COLOR if light else DARK_SQUARE_COLOR, self.square_rect(square))
+
+        # Coordinates in the margin, like chess.svg.board(coordinates=True)
+        font = pygame.font.Font(None, max(int(self.margin * 0.9), 10))
+        for index in range(8):
+            file_text = font.render(chess.FILE_NAMES[index], True, COORD_COLOR)
+            rank_text = font.render(chess.RANK_NAMES[7 - index], True, COORD_COLOR)
+            center = self.margin + (index + 0.5) * self.square_size
+            for y in (self.margin / 2, self.board_size - self.margin / 2):
+                background.blit(file_text, file_text.get_rect(center=(center, y)))
+            for x in (self.margin / 2, self.board_size - self.margin / 2):
+                background.blit(rank_text, rank_text.get_rect(center=(x, center)))
+        return background
+
+    def piece_position(self, square):
+        rect = self.square_rect(square)
+        return (rect.centerx - self.atlas.size // 2, rect.centery - self.atlas.size // 2)
+
+    def render_without(self, board, hidden):
+        # A new surface of the board with the pieces on the hidden squares left out
+        surface = self.background.copy()
+        for square, piece in board.piece_map().items():
+            if square not in hidden:
+                self.atlas.blit_piece(surface, piece, self.piece_position(square))
+        return surface
+
+    def render(self, board):
+        # The returned surface is reused for every call, copy it to keep a snapshot
+        self.surface.blit(self.background, (0, 0))
+        for square, piece in board.piece_map().items():
+            self.atlas.blit_piece(self.surface, piece, self.piece_position(square))
+        return self.surface
+
+
+class PieceImageCache:
+    # Piece surfaces keyed by (piece, size), the least recently used entries are dropped first
+
+    def __init__(self, max_entries=48, cache_dir=None):
+        self.max_entries = max_entries
+        self.cache_dir = cache_dir
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def put(self, key, image):
+        self.entries[key] = image
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def warm(self, size, atlas=None):
+        # Fill the cache with all 12 pieces of one size, reusing an existing atlas if given
+        size = int(size)
+        if atlas is None or atlas.size != size:
+            atlas = SpriteAtlas(size, self.cache_dir)
+        images = {}
+        for piece in ATLAS_PIECES:
+            images[piece] = atlas.surface.subsurface(atlas.rects[ATLAS_INDEX[piece]])
+            self.put((piece, size), images[piece])
+        return images
+
+    def get(self, piece, size):
+        key = (piece, int(size))
+        image = self.entries.get(key)
+        if image is None:
+            self.misses += 1
+            return self.warm(size)[piece]
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return image
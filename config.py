@@ -1,40 +1,59 @@
-import pygame
-import chess
-import random
-import threading
-from stockfish import Stockfish
-from opening_selector import select_opening
-from openings import openings
-
-# Initialize pygame
-pygame.init()
-
-# Board and screen configurations
-BOARD_SIZE = 600  # Keep the board size fixed
+import os
+
+# Only settings live here, importing this module has no side effects
+
+# Board and screen configurations, the window can be resized and the board follows it
+BOARD_SIZE = 600  # Board size when the window opens
+MIN_BOARD_SIZE = 240  # The board never gets smaller than this
+RESIZE_SETTLE = 0.2  # Seconds without a resize event before the board is laid out for the new size
 EXTRA_SPACE = 150  # Add extra space at the bottom for information
 SIZE = (BOARD_SIZE, BOARD_SIZE + EXTRA_SPACE)
-SCALING_FACTOR = 0.93  # Adjust this factor to align the board as needed
+# Share of the board used by the coordinate margin on each side, squares are whole pixels
+# and the margin takes the pixels that are left over
+MARGIN_RATIO = 0.035
+
+# Rasterized piece sprites are stored here so later starts skip cairosvg
+SPRITE_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".sprite_cache")
+
+# Engine evaluations are kept between sessions so repeated drills need no engine calls
+EVAL_CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".eval_cache.bin")
+EVAL_CACHE_SIZE = 200000  # Positions kept in memory and on disk
 
-# Calculate margin and square size
-MARGIN = (BOARD_SIZE - BOARD_SIZE * SCALING_FACTOR) / 2
-SQUARE_SIZE = (BOARD_SIZE * SCALING_FACTOR) / 8
+# Upper bound for the frame rate, the window sleeps on events when nothing changes
+FPS_CAP = 60
+MOVE_ANIMATION_FRAMES = 12  # Frames a moving piece slides for, 0.2 s at FPS_CAP
+# Frame times, engine latency, lock waits and cache hit rates in the info panel, toggled with F3
+PERF_HUD_VISIBLE = False
+PERF_HUD_REFRESH = 0.25  # Seconds between updates of the overlay's numbers
 
 # Stockfish configuration
 STOCKFISH_PATH = r"path/to/stockfish"  # Set the correct path to your Stockfish binary
 STOCKFISH_SKILL_LEVEL = 12  # You can adjust the skill level
-
-# Select opening before loading the main game
-SELECTED_OPENING = select_opening(openings.keys())  # Choose from the available openings
-OPENING_LINES = openings[SELECTED_OPENING]
-SELECTED_LINE = random.choice(OPENING_LINES)  # Select one random line at the start
-OPENING_MOVES = SELECTED_LINE['moves']  # Get the moves of the selected line
-
-# Thread lock for the chessboard
-BOARD_LOCK = threading.RLock()
-
-# Initialize Stockfish
-stockfish = Stockfish(STOCKFISH_PATH)
-stockfish.set_skill_level(STOCKFISH_SKILL_LEVEL)
-
-# Initialize chessboard
-board = chess.Board()
+STOCKFISH_MOVE_DELAY = 1.0  # Seconds before Stockfish's reply is shown, the window stays responsive
+STOCKFISH_POOL_SIZE = 2  # Engine processes, so the reply and the eval bar are searched at the same time
+STOCKFISH_HASH_MB = 16  # Hash table size of every engine process
+STOCKFISH_THREADS = 1  # Search threads of every engine process
+# Search limits, any of "time" (seconds), "depth" or "nodes"
+STOCKFISH_MOVE_LIMIT = {"depth": 15}
+STOCKFISH_EVAL_LIMIT = {"depth": 15}
+STOCKFISH_MULTIPV = 3  # Candidate lines shown in MultiPV mode, toggled with the M key
+# Once the book is left the engine searches while the trainee thinks: the trainee's likely
+# moves are taken from a short MultiPV search and the replies to them are computed ahead of time
+STOCKFISH_PONDER = True
+STOCKFISH_PONDER_MOVES = 3  # Predicted trainee moves per position
+STOCKFISH_PONDER_LIMIT = {"depth": 10}  # Search that predicts the trainee's moves
+
+# Repertoire files, see openings.py, opening_book.py and preanalyze.py
+REPERTOIRE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "repertoire.jsonl")
+OPENING_BOOK_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "opening_book.bin")
+PRECOMPUTED_EVAL_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "eval_table.bin")
+REPERTOIRE_CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "repertoire_cache.bin")
+
+# Every session appends its moves, mistakes, engine replies and timings here, see session_journal.py
+JOURNAL_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "session_journal.bin")
+
+# Spans of rendering, move handling, engine requests and lock waits, see tracing.py. F4 starts
+# tracing or writes what was recorded, a session that traces writes the trace when it ends too
+TRACE_ENABLED = False
+TRACE_BUFFER_EVENTS = 100000  # Newest events kept, older ones are overwritten
+TRACE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "trace.json")
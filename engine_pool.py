@@ -0,0 +1,131 @@
+import time
+import asyncio
+import threading
+import chess
+import chess.engine
+from tracing import tracer
+
+
+def make_limit(limit):
+    # Limits are written as dicts in config.py, e.g. {"depth": 15}, {"time": 0.5} or {"nodes": 200000}
+    if isinstance(limit, chess.engine.Limit):
+        return limit
+    return chess.engine.Limit(**limit)
+
+
+class PooledEngine:
+    def __init__(self, index):
+        self.index = index
+        self.transport = None
+        self.protocol = None
+
+
+class EnginePool:
+    # A fixed number of persistent UCI processes driven by chess.engine on one asyncio loop
+
+    def __init__(self, command, size=2, options=None, wait=True):
+        self.command = command
+        self.size = size
+        self.options = dict(options or {})
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name="engine-pool", daemon=True)
+        self.thread.start()
+        self.idle = None
+        self.engines = []
+
+        # With wait=False the processes start in the background and the first request waits for them
+        self.ready = asyncio.run_coroutine_threadsafe(self.start(), self.loop)
+        if wait:
+            self.ready.result()
+
+    async def start(self):
+        self.idle = asyncio.Queue()
+        for index in range(self.size):
+            engine = PooledEngine(index)
+            self.engines.append(engine)  # Listed before it starts, so shutdown() finds every process
+            await self.start_engine(engine)
+            self.idle.put_nowait(engine)
+
+    async def wait_ready(self):
+        # Shielded, a cancelled request must not cancel the startup every other request waits for
+        await asyncio.shield(asyncio.wrap_future(self.ready))
+
+    async def start_engine(self, engine):
+        engine.transport, engine.protocol = await chess.engine.popen_uci(self.command)
+        if self.options:
+            await engine.protocol.configure(self.options)
+
+    async def restart_engine(self, engine):
+        print(f"Engine {engine.index} terminated, restarting it")
+        try:
+            engine.transport.close()
+        except Exception:
+            pass
+        await self.start_engine(engine)
+
+    async def run(self, task):
+        # task(protocol) is a coroutine function, a crashed engine is restarted and the task retried once
+        await self.wait_ready()
+        queued = time.perf_counter()
+        engine = await self.idle.get()
+        track = f"engine {engine.index}"
+        tracer.complete("wait for engine", "engine", queued, time.perf_counter() - queued, track)
+        try:
+            with tracer.span("search", "engine", track):
+                try:
+                    return await task(engine.protocol)
+                except chess.engine.EngineTerminatedError:
+                    await self.restart_engine(engine)
+                    return await task(engine.protocol)
+        finally:
+            self.idle.put_nowait(engine)
+
+    def submit(self, task):
+        # Thread safe, returns a concurrent.futures.Future
+        return asyncio.run_coroutine_threadsafe(self.run(task), self.loop)
+
+    def play(self, board, limit):
+        board = board.copy()
+        return self.submit(lambda protocol: protocol.play(board, make_limit(limit)))
+
+    def analyse(self, board, limit, multipv=None):
+        board = board.copy()
+        return self.submit(lambda protocol: protocol.analyse(board, make_limit(limit), multipv=multipv))
+
+    async def shutdown(self):
+        try:
+            await self.wait_ready()
+        except (Exception, asyncio.CancelledError):
+            pass  # Engines that did start are still stopped below
+        for engine in self.engines:
+            if engine.protocol is None:
+                continue
+            try:
+                await asyncio.wait_for(engine.protocol.quit(), 2.0)
+            except (Exception, asyncio.CancelledError):
+                engine.transport.close()
+
+    def close(self):
+        if not self.loop.is_running():
+            return
+        try:
+            asyncio.run_coroutine_threadsafe(self.shutdown(), self.loop).result(5.0)
+        except Exception as e:
+            print(f"Error while stopping the engines: {e}")
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+
+class PoolEngine:
+    # Blocking best_move() and evaluate() on top of a pool, for a headless TrainerSession
+
+    def __init__(self, pool, move_limit, eval_limit):
+        self.pool = pool
+        self.move_limit = move_limit
+        self.eval_limit = eval_limit
+
+    def best_move(self, board):
+        result = self.pool.play(board, self.move_limit).result()
+        return result.move.uci() if result.move else None
+
+    def evaluate(self, board):
+        return self.pool.analyse(board, self.eval_limit).result()["score"].white()
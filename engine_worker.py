@@ -0,0 +1,107 @@
+import time
+import asyncio
+import pygame
+from tracing import traced
+
+# Posted to the pygame event queue whenever the engine finished a request or,
+# for streamed requests, reported a new search result
+ENGINE_EVENT = pygame.event.custom_type()
+
+
+class EngineRequest:
+    def __init__(self, callback, generation, progress=None):
+        self.callback = callback
+        self.progress = progress
+        self.generation = generation
+        self.cancelled = False
+        self.future = None
+
+
+class EngineWorker:
+    # Runs engine requests on the engine pool so the pygame loop never waits for Stockfish
+
+    def __init__(self, pool):
+        self.pool = pool
+        self.generation = 0
+        self.pending = set()
+
+    async def run_request(self, task, delay):
+        started = time.monotonic()
+        result = await self.pool.run(task)
+
+        # Hold the result back until the requested delay has passed, the engine is already free again
+        remaining = delay - (time.monotonic() - started)
+        if remaining > 0:
+            await asyncio.sleep(remaining)
+        return result
+
+    async def hold(self, result, delay):
+        await asyncio.sleep(delay)
+        return result
+
+    def start(self, request, coroutine):
+        self.pending.add(request)
+        request.future = asyncio.run_coroutine_threadsafe(coroutine, self.pool.loop)
+        request.future.add_done_callback(lambda future: self.finish(request, future))
+        return request
+
+    def submit(self, task, callback, delay=0.0):
+        # task(protocol) runs on an engine from the pool, callback(result) runs on the pygame loop
+        return self.start(EngineRequest(callback, self.generation), self.run_request(task, delay))
+
+    def deliver(self, result, callback, delay=0.0):
+        # A result that is already known, e.g. a pondered reply, with the same delay and cancellation as a search
+        return self.start(EngineRequest(callback, self.generation), self.hold(result, delay))
+
+    def stream(self, task, progress, callback):
+        # task(protocol, report) calls report(value) while it runs, every value reaches
+        # progress(value) on the pygame loop before callback(result) gets the final result
+        request = EngineRequest(callback, self.generation, progress)
+        report = lambda value: self.post(request, value, True)
+        return self.start(request, self.run_request(lambda protocol: task(protocol, report), 0.0))
+
+    def cancel_request(self, request):
+        # Stops one request, a running search is told to stop right away
+        request.cancelled = True
+        request.future.cancel()
+
+    def cancel(self):
+        # Drop everything queued or running, their results will never reach a callback
+        self.generation += 1
+        for request in list(self.pending):
+            request.future.cancel()
+
+    def is_current(self, request):
+        return request.generation == self.generation and not request.cancelled
+
+    def finish(self, request, future):
+        self.pending.discard(request)
+        if future.cancelled() or not self.is_current(request):
+            return
+        if future.exception() is not None:
+            print(f"Error during engine request: {future.exception()}")
+            return
+
+        self.post(request, future.result(), False)
+
+    def post(self, request, result, partial):
+        if not self.is_current(request):
+            return
+        try:
+            pygame.event.post(pygame.event.Event(ENGINE_EVENT, request=request, result=result, partial=partial))
+        except pygame.error:
+            pass  # The display was closed while the engine was thinking
+
+    @traced("engine")
+    def dispatch(self, event):
+        # Called from the pygame loop for every ENGINE_EVENT
+        if not self.is_current(event.request):
+            return
+        if event.partial:
+            event.request.progress(event.result)
+        else:
+            event.request.callback(event.result)
+
+    def stop(self):
+        self.cancel()
+        self.pool.close()
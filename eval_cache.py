@@ -0,0 +1,109 @@
+import os
+import struct
+from collections import OrderedDict
+import chess
+import chess.engine
+import chess.polyglot
+
+# Every entry is 12 bytes on disk: zobrist key, score, search depth and score kind
+FILE_MAGIC = b"PCEVAL01"
+RECORD = struct.Struct("<QhBB")
+
+SCORE_CP = 0
+SCORE_MATE = 1
+SCORE_MATE_GIVEN = 2
+
+
+def position_key(board):
+    return chess.polyglot.zobrist_hash(board)
+
+
+def pack_score(score):
+    # Scores are stored from White's point of view, clamped to fit a signed 16 bit value
+    if score == chess.engine.MateGiven:
+        return SCORE_MATE_GIVEN, 0
+    if score.is_mate():
+        return SCORE_MATE, score.mate()
+    return SCORE_CP, max(min(score.score(), 32767), -32768)
+
+
+def unpack_score(kind, value):
+    if kind == SCORE_MATE_GIVEN:
+        return chess.engine.MateGiven
+    if kind == SCORE_MATE:
+        return chess.engine.Mate(value)
+    return chess.engine.Cp(value)
+
+
+class EvalCache:
+    # Engine evaluations keyed by position, a deeper search is never replaced by a shallower one
+
+    def __init__(self, max_entries=200000, path=None):
+        self.max_entries = max_entries
+        self.path = path
+        self.entries = OrderedDict()  # key -> (depth, kind, value)
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, board, min_depth=0):
+        found = self.lookup(board, min_depth)
+        return found[0] if found is not None else None
+
+    def lookup(self, board, min_depth=0):
+        # Like get() but returns (score, depth), so a shallow entry can be shown while searching deeper
+        key = position_key(board)
+        entry = self.entries.get(key)
+        if entry is None or entry[0] < min_depth:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return unpack_score(entry[1], entry[2]), entry[0]
+
+    def put_key(self, key, depth, kind, value):
+        entry = self.entries.get(key)
+        if entry is not None and entry[0] > depth:
+            self.entries.move_to_end(key)
+            return
+        self.entries[key] = (depth, kind, value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def put(self, board, score, depth):
+        kind, value = pack_score(score)
+        self.put_key(position_key(board), min(max(depth or 0, 0), 255), kind, value)
+
+    def load(self, path=None):
+        # Loads this cache's own file, or another file in the same format such as the precomputed table
+        path = path or self.path
+        if path is None or not os.path.exists(path):
+            return 0
+        with open(path, "rb") as f:
+            if f.read(len(FILE_MAGIC)) != FILE_MAGIC:
+                print(f"Ignoring {path}, it is not an evaluation cache")
+                return 0
+            data = f.read()
+
+        # The file is written oldest first, so loading keeps the LRU order
+        usable = len(data) - len(data) % RECORD.size
+        for key, value, depth, kind in RECORD.iter_unpack(data[:usable]):
+            self.put_key(key, depth, kind, value)
+        return usable // RECORD.size
+
+    def save(self):
+        if self.path is None:
+            return
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        # Write to a temporary file first so a crash never leaves a truncated cache behind
+        temporary_path = self.path + ".tmp"
+        with open(temporary_path, "wb") as f:
+            f.write(FILE_MAGIC)
+            f.write(b"".join(RECORD.pack(key, value, depth, kind) for key, (depth, kind, value) in self.entries.items()))
+        os.replace(temporary_path, self.path)
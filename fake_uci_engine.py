@@ -0,0 +1,108 @@
+import sys
+import threading
+import chess
+
+# A tiny scripted UCI engine that can stand in for Stockfish when testing:
+#   python fake_uci_engine.py
+# It always plays the first legal move in UCI order and reports a material count as its score.
+# "setoption name Delay value <ms>" makes every search take that long.
+
+PIECE_VALUES = {chess.PAWN: 100, chess.KNIGHT: 300, chess.BISHOP: 300, chess.ROOK: 500, chess.QUEEN: 900, chess.KING: 0}
+
+
+def send(line):
+    sys.stdout.write(line + "\n")
+    sys.stdout.flush()
+
+
+def material(board):
+    score = 0
+    for piece in board.piece_map().values():
+        value = PIECE_VALUES[piece.piece_type]
+        score += value if piece.color == board.turn else -value
+    return score
+
+
+def search(board, depth, delay, infinite, stop, multipv=1):
+    moves = sorted(board.legal_moves, key=lambda move: move.uci())
+    if not moves:
+        send("info depth 0 score mate 0" if board.is_checkmate() else "info depth 0 score cp 0")
+        if infinite:
+            stop.wait()
+        send("bestmove (none)")
+        return
+
+    best_move = moves[0]
+    score = material(board)
+    for current_depth in range(1, depth + 1):
+        if stop.wait(delay / depth):
+            break
+        # With MultiPV the next moves in sorted order are the other lines, each a pawn worse
+        for index, move in enumerate(moves[:multipv]):
+            send(f"info depth {current_depth} seldepth {current_depth} multipv {index + 1} score cp {score - index * 100} nodes {current_depth * 1000} nps 1000000 pv {move.uci()}")
+
+    # "go infinite" only answers once the GUI sends stop
+    if infinite:
+        stop.wait()
+    send(f"bestmove {best_move.uci()}")
+
+
+def main():
+    board = chess.Board()
+    delay = 0.0
+    multipv = 1
+    stop = threading.Event()
+    searcher = None
+
+    for line in sys.stdin:
+        parts = line.split()
+        if not parts:
+            continue
+        command = parts[0]
+
+        # Like a real engine, a running search only reacts to stop, isready and quit
+        if command not in ("stop", "isready", "quit") and searcher is not None:
+            searcher.join()
+            searcher = None
+
+        if command == "uci":
+            send("id name FakeEngine")
+            send("id author pythonchess")
+            send("option name Delay type spin default 0 min 0 max 60000")
+            send("option name Hash type spin default 16 min 1 max 1024")
+            send("option name Threads type spin default 1 min 1 max 64")
+            send("option name Skill Level type spin default 20 min 0 max 20")
+            send("option name MultiPV type spin default 1 min 1 max 500")
+            send("uciok")
+        elif command == "isready":
+            send("readyok")
+        elif command == "setoption" and len(parts) >= 5 and parts[2] == "Delay":
+            delay = int(parts[4]) / 1000.0
+        elif command == "setoption" and len(parts) >= 5 and parts[2] == "MultiPV":
+            multipv = int(parts[4])
+        elif command == "ucinewgame":
+            board = chess.Board()
+        elif command == "position":
+            if parts[1] == "startpos":
+                board = chess.Board()
+                rest = parts[2:]
+            else:
+                board = chess.Board(" ".join(parts[2:8]))
+                rest = parts[8:]
+            if rest and rest[0] == "moves":
+                for uci_move in rest[1:]:
+                    board.push_uci(uci_move)
+        elif command == "go":
+            depth = int(parts[parts.index("depth") + 1]) if "depth" in parts else 5
+            stop = threading.Event()
+            searcher = threading.Thread(target=search, args=(board.copy(), depth, delay, "infinite" in parts, stop, multipv))
+            searcher.start()
+        elif command == "stop":
+            stop.set()
+        elif command == "quit":
+            stop.set()
+            return
+
+
+if __name__ == "__main__":
+    main()
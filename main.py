@@ -1,360 +1,778 @@
+import os
 import sys
+import time
+import threading
+from collections import deque
 import pygame
 import chess
-import chess.svg
-import io
-import time
-from cairosvg import svg2png
-from threading import Thread
+import chess.engine
 from config import (
-    BOARD_SIZE,
     EXTRA_SPACE,
     SIZE,
-    MARGIN,
-    SQUARE_SIZE,
-    board,
-    stockfish,
-    BOARD_LOCK,
-    OPENING_MOVES,
-    SELECTED_LINE,
-    SELECTED_OPENING,
-    SCALING_FACTOR,
+    MIN_BOARD_SIZE,
+    RESIZE_SETTLE,
+    MARGIN_RATIO,
+    SPRITE_CACHE_DIR,
+    FPS_CAP,
+    MOVE_ANIMATION_FRAMES,
+    PERF_HUD_VISIBLE,
+    PERF_HUD_REFRESH,
+    STOCKFISH_PATH,
+    STOCKFISH_SKILL_LEVEL,
+    STOCKFISH_MOVE_DELAY,
+    STOCKFISH_POOL_SIZE,
+    STOCKFISH_HASH_MB,
+    STOCKFISH_THREADS,
+    STOCKFISH_MOVE_LIMIT,
+    STOCKFISH_EVAL_LIMIT,
+    STOCKFISH_MULTIPV,
+    STOCKFISH_PONDER,
+    STOCKFISH_PONDER_MOVES,
+    STOCKFISH_PONDER_LIMIT,
+    EVAL_CACHE_PATH,
+    EVAL_CACHE_SIZE,
+    OPENING_BOOK_PATH,
+    REPERTOIRE_CACHE_PATH,
+    PRECOMPUTED_EVAL_PATH,
+    JOURNAL_PATH,
+    TRACE_ENABLED,
+    TRACE_BUFFER_EVENTS,
+    TRACE_PATH,
+)
+from engine_pool import EnginePool, make_limit
+from engine_worker import EngineWorker, ENGINE_EVENT
+from eval_cache import EvalCache, position_key, pack_score
+from opening_book import start_opening_book
+from trainer_session import TrainerSession, NOT_YOUR_TURN, NOT_IN_BOOK
+from text_cache import render_text, fit_text, text_fits, text_cache
+from move_animation import MoveAnimation, move_paths
+from move_encoding import encode_uci
+from perf_hud import PerfHud, TimedLock, HUD_WIDTH
+from tracing import tracer, traced
+from session_journal import (
+    SessionJournal,
+    SESSION_START,
+    PLAYER_MOVE,
+    WRONG_MOVE,
+    BOOK_REPLY,
+    ENGINE_REPLY,
+    EVALUATION,
+    ENGINE_LATENCY,
+    RENDER,
 )
-from PIL import Image
-from io import BytesIO
-from xml.etree import ElementTree as ET
-
-# Initialize other global variables
-white_eval = None
-black_eval = None
-opening_index = 0  # Index for the current move within the selected line 
-
-# Set up the display
-screen = pygame.display.set_mode(SIZE, pygame.DOUBLEBUF)
-pygame.display.set_caption('Chess Opening')
-
-def analyze_with_stockfish():
-    global white_eval, black_eval
-    stockfish.set_fen_position(board.fen())
-    
+
+EVAL_BAR_HEIGHT = 30
+PANEL_COLOR = (255, 255, 255)
+
+
+def analysis_lines(board, infos):
+    # (score from White's point of view, depth, first moves in SAN) for every line that has a score yet
+    lines = []
+    for info in infos:
+        if "score" not in info:
+            continue
+        pv = info.get("pv", [])[:6]
+        try:
+            san = board.variation_san(pv)
+        except ValueError:
+            san = ""
+        lines.append((info["score"].white(), info.get("depth", 0), san))
+    return lines
+
+
+async def stream_stockfish_evaluation(engine, board, report, multipv=1):
+    # Runs on the engine pool, calls report(lines) every time the search completes a depth
+    # and returns the final lines, the best one first
     try:
-        evaluation = stockfish.get_evaluation()
-    except Exception as e:
+        with await engine.analysis(board, make_limit(STOCKFISH_EVAL_LIMIT), multipv=multipv if multipv > 1 else None) as analysis:
+            async for info in analysis:
+                # With MultiPV the engine sends the lines of a depth one after the other
+                if "score" in info and info.get("multipv", 1) == min(multipv, board.legal_moves.count()):
+                    report(analysis_lines(board, analysis.multipv))
+        return analysis_lines(board, analysis.multipv)
+    except chess.engine.EngineTerminatedError:
+        raise  # The pool restarts the engine and retries the evaluation
+    except chess.engine.EngineError as e:
         print(f"Error during Stockfish evaluation: {e}")
-        evaluation = {'type': 'cp', 'value': 0}
-
-    if 'type' in evaluation and evaluation['type'] == 'cp':
-        white_eval = evaluation['value'] / 100.0
-        black_eval = -white_eval
-    elif 'type' in evaluation and evaluation['type'] == 'mate':
-        if evaluation['value'] > 0:
-            white_eval = f"M{evaluation['value']}"
-            black_eval = f"M{-evaluation['value']}"
+        return []
+
+
+async def ponder_stockfish_replies(engine, board, report):
+    # Runs on the engine pool while the trainee thinks, predicts their most likely moves
+    # and reports (position key after the move, Black's reply) as soon as each reply is known
+    infos = await engine.analyse(board, make_limit(STOCKFISH_PONDER_LIMIT), multipv=STOCKFISH_PONDER_MOVES)
+    predicted = [info["pv"][0] for info in infos if info.get("pv")]
+    for move in predicted:
+        board.push(move)
+        result = await engine.play(board, make_limit(STOCKFISH_MOVE_LIMIT))
+        if result.move:
+            report((position_key(board), result.move.uci()))
+        board.pop()
+    return len(predicted)
+
+
+def format_score(score):
+    if score.is_mate():
+        return f"M{score.mate()}" if score.mate() > 0 else f"-M{-score.mate()}"
+    return f"{score.score() / 100.0:+.2f}"
+
+
+async def get_stockfish_best_move(engine, board):
+    # Runs on the engine pool
+    result = await engine.play(board, make_limit(STOCKFISH_MOVE_LIMIT))
+    return result.move.uci() if result.move else None
+
+
+class ChessTrainer:
+    # Window of one training session, the rules live in TrainerSession
+
+    def __init__(self, opening_book, opening_name, engine_pool, journal_path=JOURNAL_PATH, eval_cache_path=EVAL_CACHE_PATH):
+        from board_renderer import BoardRenderer, PieceImageCache
+        from render_scheduler import RenderScheduler
+
+        self.session = TrainerSession(opening_book, opening_name)
+        self.board = self.session.board
+        self.board_lock = TimedLock(threading.RLock())  # Time spent waiting is shown by the performance overlay
+        self.white_eval = None
+        self.black_eval = None
+        self.multipv = 1  # STOCKFISH_MULTIPV lines while MultiPV mode is on
+        self.analysis_lines = []
+        self.analysis_request = None
+        self.pondered_replies = {}  # position key after the trainee's move -> Black's reply
+
+        # Set up the display
+        self.screen = pygame.display.set_mode(SIZE, pygame.DOUBLEBUF | pygame.RESIZABLE)
+        pygame.display.set_caption('Chess Opening')
+
+        # Only regions marked dirty are redrawn and pushed to the display
+        self.render_scheduler = RenderScheduler(FPS_CAP)
+
+        # All Stockfish calls run here, results come back to the main loop as ENGINE_EVENTs
+        self.engine_worker = EngineWorker(engine_pool)
+
+        # Moves, mistakes, engine replies and timings of every session are appended here
+        self.journal = SessionJournal(journal_path)
+        self.journal.record(SESSION_START, line=self.session.current_line_id)
+        self.turn_started = time.monotonic()  # Start of the trainee's current think time
+        self.move_requested = None
+        self.move_pondered = False
+        self.analysis_started = None
+
+        # Evaluations from preanalyze.py and of positions seen in previous sessions
+        self.eval_cache = EvalCache(EVAL_CACHE_SIZE, eval_cache_path)
+        self.eval_cache.load(PRECOMPUTED_EVAL_PATH)
+        self.eval_cache.load()
+
+        # Squares and piece sprites are rasterized once per size, every move is just blits
+        self.board_renderer = BoardRenderer(SIZE[0], MARGIN_RATIO, SPRITE_CACHE_DIR)
+
+        # Dragged pieces come from this cache, warmed with the atlas the board already uses
+        self.piece_images = PieceImageCache(cache_dir=SPRITE_CACHE_DIR)
+
+        # Performance overlay, F3 shows and hides it
+        self.perf_hud = PerfHud(FPS_CAP, PERF_HUD_REFRESH, PERF_HUD_VISIBLE)
+        self.perf_hud.watch_lock(self.board_lock)
+        self.perf_hud.watch_cache("eval", self.eval_cache)
+        self.perf_hud.watch_cache("text", text_cache)
+        self.perf_hud.watch_cache("pieces", self.piece_images)
+
+        # Moves pushed since the board surface was last rendered slide in one after the other
+        self.animations = deque()
+        self.shown_ply = self.board.ply()
+
+        self.layout()
+
+        # Mouse state of the main loop
+        self.selected_square = None
+        self.possible_moves = None
+        self.dragging = False
+        self.clicking = False  # Distinguishes between clicking and dragging
+        self.dragged_piece = None
+        self.click_start_pos = None
+        self.last_drag_rect = None
+        self.resize_due = None  # When the window size is taken over, see run()
+
+    def apply_evaluation(self, score):
+        if score.is_mate():
+            mate = score.mate()
+            if mate > 0:
+                self.white_eval = f"M{mate}"
+                self.black_eval = f"M{-mate}"
+            else:
+                self.white_eval = f"M{-mate}"
+                self.black_eval = f"M{mate}"
+        elif score.score() is not None:
+            self.white_eval = score.score() / 100.0
+            self.black_eval = -self.white_eval
         else:
-            white_eval = f"M{-evaluation['value']}"
-            black_eval = f"M{evaluation['value']}"
-    else:
-        white_eval = 0.0  # Neutral value for initial load
-        black_eval = 0.0
-
-def analyze_with_stockfish_and_render():
-    with BOARD_LOCK:
-        analyze_with_stockfish()
-        global board_surface
-        board_surface = render_board_surface()
-        draw_board()
-
-# Pre-render the board surface
-def render_board_surface():
-    svg_data = chess.svg.board(board, size=BOARD_SIZE, coordinates=True)
-    png_data = svg2png(bytestring=svg_data.encode('utf-8'))
-    image = pygame.image.load(io.BytesIO(png_data))
-    return pygame.transform.scale(image, (int(BOARD_SIZE), int(BOARD_SIZE)))
-
-board_surface = render_board_surface()
-
-# Function to draw the board
-def draw_board(selected_square=None, dragging_piece=None, mouse_pos=None, possible_moves=None):
-    # Draw the cached board surface
-    screen.blit(board_surface, (0, 0))
-
-    # Draw possible moves if a square is selected
-    if possible_moves is not None:
-        for target_square in possible_moves:
-            target_col = chess.square_file(target_square)
-            target_row = 7 - chess.square_rank(target_square)
-            center_x = int(MARGIN + target_col * SQUARE_SIZE + SQUARE_SIZE / 2)
-            center_y = int(MARGIN + target_row * SQUARE_SIZE + SQUARE_SIZE / 2)
-            pygame.draw.circle(screen, (128, 128, 128), (center_x, center_y), SQUARE_SIZE // 6)
-
-    if dragging_piece is not None and mouse_pos is not None:
-       piece = board.piece_at(dragging_piece)
-       if piece:
-           piece_svg = chess.svg.piece(piece, size=SQUARE_SIZE)
-           piece_png = svg2png(bytestring=piece_svg.encode('utf-8'))
-           piece_image = pygame.image.load(io.BytesIO(piece_png))
-           piece_image = pygame.transform.scale(piece_image, (int(SQUARE_SIZE), int(SQUARE_SIZE)))
-           screen.blit(piece_image, (mouse_pos[0] - SQUARE_SIZE // 2, mouse_pos[1] - SQUARE_SIZE // 2))
-
-    # Add space for additional information at the bottom
-    pygame.draw.rect(screen, (255, 255, 255), pygame.Rect(0, BOARD_SIZE, SIZE[0], EXTRA_SPACE))
-
-    # Draw the evaluation bar
-    eval_bar_height = 30  # Height of the evaluation bar
-    eval_bar_width = BOARD_SIZE  # Full width of the board
-    eval_bar_x = 0  # Start at the left edge
-    eval_bar_y = BOARD_SIZE  # Position it just below the board 
-
-    if white_eval is None:
-        white_eval_value = 0.0
-    else:
-        white_eval_value = white_eval
-
-    if isinstance(white_eval_value, str):
-        if white_eval_value.startswith('M'):
-            white_ratio = 1.0 if white_eval_value[1] == '-' else 0.0
+            self.white_eval = 0.0  # Neutral value for initial load
+            self.black_eval = 0.0
+
+        self.render_scheduler.mark(self.eval_bar_rect)
+
+    def show_analysis(self, lines):
+        # Every completed depth refines the eval bar and the candidate lines in place
+        if not lines:
+            return
+        self.apply_evaluation(lines[0][0])
+        if self.multipv > 1:
+            self.analysis_lines = lines
+            self.render_scheduler.mark(self.info_panel_rect)
+
+    @traced("engine")
+    def store_evaluation(self, position, lines):
+        self.analysis_request = None
+        if lines:
+            self.eval_cache.put(position, lines[0][0], lines[0][1])
+            kind, value = pack_score(lines[0][0])
+            self.journal.record(EVALUATION, ply=position.ply(), value=value, flags=kind, other=lines[0][1])
+        if self.analysis_started is not None:
+            latency = time.monotonic() - self.analysis_started
+            depth = lines[0][1] if lines else 0
+            self.journal.record(ENGINE_LATENCY, ply=position.ply(), value=int(latency * 1000), other=depth)
+            self.perf_hud.record_engine(latency, depth)
+        self.show_analysis(lines)
+
+    @traced("engine")
+    def analyze_with_stockfish(self):
+        # The search of the previous position is stopped as soon as the board changes
+        if self.analysis_request is not None:
+            self.engine_worker.cancel_request(self.analysis_request)
+            self.analysis_request = None
+        if self.analysis_lines:
+            self.analysis_lines = []
+            self.render_scheduler.mark(self.info_panel_rect)
+
+        # Any cached evaluation is shown right away, one as deep as the configured search ends it
+        # unless the candidate lines are wanted too
+        cached = self.eval_cache.lookup(self.board)
+        if cached is not None:
+            self.apply_evaluation(cached[0])
+            if cached[1] >= STOCKFISH_EVAL_LIMIT.get("depth", 0) and self.multipv == 1:
+                return
+
+        # Otherwise the engine's results stream in as the search gets deeper
+        position = self.board.copy()
+        multipv = self.multipv
+        self.analysis_started = time.monotonic()
+        self.analysis_request = self.engine_worker.stream(
+            lambda engine, report: stream_stockfish_evaluation(engine, position, report, multipv),
+            self.show_analysis,
+            lambda lines: self.store_evaluation(position, lines),
+        )
+
+    def ponder(self):
+        # Black's answers to the trainee's likely moves are searched during the trainee's turn
+        self.pondered_replies = {}
+        if not STOCKFISH_PONDER or not self.session.has_legal_moves():
+            return
+        if self.session.continuations():
+            return  # Book moves are checked against the repertoire, not answered by the engine
+        position = self.board.copy()
+        self.engine_worker.stream(
+            lambda engine, report: ponder_stockfish_replies(engine, position, report),
+            self.store_pondered_reply,
+            lambda predicted: None,
+        )
+
+    def store_pondered_reply(self, pondered):
+        key, reply = pondered
+        self.pondered_replies[key] = reply
+
+    def toggle_perf_hud(self):
+        # The overlay's own area is redrawn as well, beside the board it lies outside the info panel
+        self.perf_hud.toggle()
+        self.render_scheduler.mark(self.info_panel_rect)
+        self.render_scheduler.mark(self.perf_hud_rect)
+
+    def write_trace(self):
+        # The first press starts tracing, every later one writes the newest events
+        if not tracer.enabled:
+            tracer.start(TRACE_BUFFER_EVENTS)
+            print(f"Tracing started, press F4 again to write {TRACE_PATH}")
+            return
+        count = tracer.dump(TRACE_PATH)
+        print(f"Wrote {count} trace events to {TRACE_PATH}")
+
+    def toggle_multipv(self):
+        self.multipv = STOCKFISH_MULTIPV if self.multipv == 1 else 1
+        print(f"Showing {self.multipv} engine line(s)")
+        self.analyze_with_stockfish()
+
+    def layout(self):
+        # Fits the board to the window, called at startup and whenever the window is resized
+        self.screen = pygame.display.get_surface()
+        width, height = self.screen.get_size()
+        board_size = max(min(width, height - EXTRA_SPACE), MIN_BOARD_SIZE)
+        self.board_renderer.resize(board_size)
+        self.animations.clear()  # Their frames were computed for the old size
+        self.piece_images.warm(self.board_renderer.atlas.size, self.board_renderer.atlas)
+        self.board_surface = self.render_board_surface()
+
+        self.eval_bar_rect = pygame.Rect(0, board_size, board_size, EVAL_BAR_HEIGHT)
+        self.info_panel_rect = pygame.Rect(0, board_size, width, max(height - board_size, 0))
+        self.side_rect = pygame.Rect(board_size, 0, max(width - board_size, 0), board_size)
+
+        # The performance overlay goes beside the board in a wide window, otherwise into the right
+        # part of the info panel, whose text is then kept to the left of it
+        self.perf_hud_in_panel = self.side_rect.width < HUD_WIDTH
+        if self.perf_hud_in_panel:
+            text_area = pygame.Rect(0, self.eval_bar_rect.bottom, width, max(self.info_panel_rect.bottom - self.eval_bar_rect.bottom, 0))
+            self.perf_hud_rect = self.perf_hud.rect(text_area)
         else:
-            white_ratio = 0.5
-    else:
-        max_eval = 10
-        min_eval = -10
-        white_ratio = max(min((white_eval_value + max_eval) / (max_eval - min_eval), 1.0), 0.0)
-    
-    black_ratio = 1.0 - white_ratio
-
-    # Draw white part of the bar
-    pygame.draw.rect(screen, (255, 255, 255), pygame.Rect(eval_bar_x, eval_bar_y, eval_bar_width * white_ratio, eval_bar_height))
-
-    # Draw black part of the bar horizontally
-    pygame.draw.rect(screen, (0, 0, 0), pygame.Rect(eval_bar_x + eval_bar_width * white_ratio, eval_bar_y, eval_bar_width * black_ratio, eval_bar_height))
-
-    # Draw the outline of the eval bar
-    pygame.draw.rect(screen, (0, 0, 0), pygame.Rect(eval_bar_x, eval_bar_y, eval_bar_width, eval_bar_height), 2)
-
-    # Display the current opening and line
-    font = pygame.font.Font(None, 20)
-    current_line = SELECTED_LINE['name']
-    remaining_moves = len(OPENING_MOVES) - opening_index
-    opening_text = f"Opening: {SELECTED_OPENING} - {current_line} (Moves Left: {remaining_moves})"
-    opening_surface = font.render(opening_text, True, (0, 0, 0))
-    screen.blit(opening_surface, (10, BOARD_SIZE + eval_bar_height + 10))
-
-    # Display important game information
-    game_status_text = ""
-    if board.is_checkmate():
-        game_status_text = "Checkmate"
-    elif board.is_check():
-        game_status_text = "Check"
-    elif board.is_stalemate():
-        game_status_text = "Stalemate"
-
-    if game_status_text:
-        status_surface = font.render(game_status_text, True, (255, 0, 0))
-        screen.blit(status_surface, (10, BOARD_SIZE + eval_bar_height + 50))
-
-    pygame.display.flip()
-
-# Main game loop
-running = True
-selected_square = None
-dragging = False
-dragged_piece = None
-possible_moves = None
-board_needs_update = False
-
-def handle_stockfish_move():
-    with BOARD_LOCK:
-        if board.turn != chess.BLACK:
-            print("It's not Black's turn, returning early.")
-            return  # Stockfish should only move for Black
-
-        # Set the FEN position and verify
-        fen_position = board.fen()
-        stockfish.set_fen_position(fen_position)
-
-        time.sleep(1)  # Introduce a short delay
-        best_move = stockfish.get_best_move()
-
-        print(f"Stockfish best move: {best_move}")
-
-        # Ensure that Stockfish is only making moves for Black
-        if best_move and board.turn == chess.BLACK:
-            move = chess.Move.from_uci(best_move)
-
-            if move in board.legal_moves:
-                board.push(move)
-
-                dragged_piece = None
-                possible_moves = None
-                
-                global board_surface
-
-                board_surface = render_board_surface()
-                draw_board()
-
-                analyze_with_stockfish_and_render()
-
-                # Ensure Stockfish continues to move if it's still Black's turn
-                if board.turn == chess.BLACK:
-                    handle_stockfish_move()
+            self.perf_hud_rect = self.perf_hud.rect(self.side_rect)
+
+        # On HiDPI displays the window can have fewer points than the surface has pixels
+        window_width, window_height = pygame.display.get_window_size()
+        self.pixel_ratio = (width / max(window_width, 1), height / max(window_height, 1))
+        self.render_scheduler.mark_all()
+
+    def to_pixels(self, pos):
+        return (int(pos[0] * self.pixel_ratio[0]), int(pos[1] * self.pixel_ratio[1]))
+
+    # Pre-render the board surface
+    @traced("render")
+    def render_board_surface(self):
+        return self.board_renderer.render(self.board)
+
+    def mark_squares_dirty(self, squares):
+        for square in squares:
+            self.render_scheduler.mark(self.board_renderer.square_rect(square))
+
+    @traced("render")
+    def board_changed(self, before):
+        # Mark every square whose piece changed after moves were pushed, including castling and en passant
+        after = set(self.board.piece_map().items())
+        self.mark_squares_dirty({square for square, piece in before ^ after})
+        self.render_scheduler.mark(self.info_panel_rect)
+        if self.board.turn == chess.WHITE:
+            self.turn_started = time.monotonic()
+
+        # Every new move gets its animation now, the board without the moving pieces is rendered once per ply
+        new_moves = self.board.move_stack[self.shown_ply:]
+        self.shown_ply = self.board.ply()
+        position = self.board.copy()
+        for _ in new_moves:
+            position.pop()
+        for index, move in enumerate(new_moves):
+            paths = move_paths(position, move)
+            position.push(move)
+            if index == 0 and self.dragging:
+                continue  # The trainee already dropped the piece on its square
+            static = self.board_renderer.render_without(position, {to_square for _, _, to_square in paths})
+            self.animations.append(MoveAnimation(static, paths, self.board_renderer, MOVE_ANIMATION_FRAMES))
+
+        if not self.animations:
+            self.board_surface = self.render_board_surface()
+        elif not self.animations[0].started:
+            # Shown right away, a piece dropped by the trainee must not appear on its old square until the next frame
+            self.board_surface = self.animations[0].static
+            self.mark_squares_dirty(self.animations[0].squares)
+
+    @traced("render")
+    def advance_animation(self):
+        # One precomputed frame per loop iteration, only the sprites' old and new rectangles are redrawn
+        if not self.animations:
+            return
+        animation = self.animations[0]
+        for rect in animation.rects():
+            self.render_scheduler.mark(rect)
+
+        if not animation.started:
+            self.board_surface = animation.static
+            self.mark_squares_dirty(animation.squares)
+        animation.frame += 1
+
+        if animation.done:
+            # The next animation's board already has this move's piece on its square
+            self.animations.popleft()
+            self.mark_squares_dirty(animation.squares)
+            if self.animations:
+                self.board_surface = self.animations[0].static
+                self.mark_squares_dirty(self.animations[0].squares)
             else:
-                print(f"Illegal move by Stockfish: {best_move} in {board.fen()}")
+                self.board_surface = self.render_board_surface()
+            return
+
+        for rect in animation.rects():
+            self.render_scheduler.mark(rect)
+
+    def mark_selection_dirty(self, selected, targets):
+        # The selection dots live on the move targets of the selected square
+        if selected is not None:
+            self.mark_squares_dirty([selected])
+        if targets:
+            self.mark_squares_dirty(targets)
+
+    def drag_rect(self, pos):
+        piece_size = self.board_renderer.atlas.size
+        return pygame.Rect(pos[0] - piece_size // 2, pos[1] - piece_size // 2, piece_size, piece_size)
+
+    # Function to draw the board
+    @traced("render")
+    def draw_board(self, selected_square=None, dragging_piece=None, mouse_pos=None, possible_moves=None):
+        screen = self.screen
+        frame_started = time.perf_counter()
+        if self.perf_hud.is_stale():
+            self.render_scheduler.mark(self.perf_hud_rect)
+
+        # Everything below is clipped to the dirty regions of this frame
+        screen.set_clip(self.render_scheduler.clip_rect(screen))
+
+        # Draw the cached board surface
+        screen.blit(self.board_surface, (0, 0))
+
+        # Draw possible moves if a square is selected
+        if possible_moves is not None:
+            for target_square in possible_moves:
+                target_rect = self.board_renderer.square_rect(target_square)
+                pygame.draw.circle(screen, (128, 128, 128), target_rect.center, self.board_renderer.square_size // 6)
+
+        # Pieces that are still sliding into place
+        if self.animations:
+            for piece, pos in self.animations[0].sprites():
+                self.board_renderer.atlas.blit_piece(screen, piece, pos)
+
+        if dragging_piece is not None and mouse_pos is not None:
+            piece = self.board.piece_at(dragging_piece)
+            if piece:
+                piece_size = self.board_renderer.atlas.size
+                piece_image = self.piece_images.get(piece, piece_size)
+                screen.blit(piece_image, (mouse_pos[0] - piece_size // 2, mouse_pos[1] - piece_size // 2))
+
+        # Add space for additional information at the bottom, and beside the board in a wide window
+        pygame.draw.rect(screen, PANEL_COLOR, self.info_panel_rect)
+        pygame.draw.rect(screen, PANEL_COLOR, self.side_rect)
+
+        # Draw the evaluation bar
+        eval_bar_height = self.eval_bar_rect.height
+        eval_bar_width = self.eval_bar_rect.width  # Full width of the board
+        eval_bar_x = self.eval_bar_rect.x  # Start at the left edge
+        eval_bar_y = self.eval_bar_rect.y  # Position it just below the board
+
+        if self.white_eval is None:
+            white_eval_value = 0.0
         else:
-            print("Stockfish did not return a valid move or attempted to move White's pieces.")
+            white_eval_value = self.white_eval
 
-def process_player_move(uci_move):
-    global opening_index, selected_square, possible_moves, board_surface
-
-    move = chess.Move.from_uci(uci_move)
-
-    with BOARD_LOCK:
-
-        if board.turn != chess.WHITE:
-            print("It's not White's turn, returning early.")
-            return  # Only process the player's move if it's White's turn
+        if isinstance(white_eval_value, str):
+            if white_eval_value.startswith('M'):
+                white_ratio = 1.0 if white_eval_value[1] == '-' else 0.0
+            else:
+                white_ratio = 0.5
+        else:
+            max_eval = 10
+            min_eval = -10
+            white_ratio = max(min((white_eval_value + max_eval) / (max_eval - min_eval), 1.0), 0.0)
 
-        if opening_index < len(SELECTED_LINE['moves']):
-            expected_move = SELECTED_LINE['moves'][opening_index]
+        black_ratio = 1.0 - white_ratio
 
-            if uci_move == expected_move:
-                board.push(chess.Move.from_uci(uci_move))
-                opening_index += 1
+        # Draw white part of the bar
+        pygame.draw.rect(screen, (255, 255, 255), pygame.Rect(eval_bar_x, eval_bar_y, eval_bar_width * white_ratio, eval_bar_height))
 
-                selected_square = None
-                possible_moves = None
+        # Draw black part of the bar horizontally
+        pygame.draw.rect(screen, (0, 0, 0), pygame.Rect(eval_bar_x + eval_bar_width * white_ratio, eval_bar_y, eval_bar_width * black_ratio, eval_bar_height))
 
-                # Update the board surface and render it immediately
-                board_surface = render_board_surface()
-                draw_board(selected_square)
+        # Draw the outline of the eval bar
+        pygame.draw.rect(screen, (0, 0, 0), pygame.Rect(eval_bar_x, eval_bar_y, eval_bar_width, eval_bar_height), 2)
 
-                if opening_index < len(SELECTED_LINE['moves']):
-                    expected_move = SELECTED_LINE['moves'][opening_index]
-                    board.push_uci(expected_move)
-                    opening_index += 1
+        # Text of the info panel stays left of the performance overlay
+        text_width = self.info_panel_rect.width - 20
+        if self.perf_hud.visible and self.perf_hud_in_panel:
+            text_width -= self.perf_hud_rect.width
 
-                    # Analyze the position immediately
-                    analyze_with_stockfish_and_render()
+        # Display the current opening and line, the moves left get their own line when it does not fit
+        opening_text = f"Opening: {self.session.opening_name} - {self.session.line_name}"
+        moves_left_text = f"(Moves Left: {self.session.remaining_moves})"
+        full_text = f"{opening_text} {moves_left_text}"
+        if text_fits(full_text, 20, text_width):
+            screen.blit(render_text(full_text, 20, (0, 0, 0)), (10, eval_bar_y + eval_bar_height + 10))
+        else:
+            screen.blit(render_text(fit_text(opening_text, 20, text_width), 20, (0, 0, 0)), (10, eval_bar_y + eval_bar_height + 10))
+            screen.blit(render_text(moves_left_text, 20, (0, 0, 0)), (10, eval_bar_y + eval_bar_height + 30))
+
+        # Display important game information, computed once per ply
+        game_status_text = self.session.snapshot.status
+
+        if game_status_text:
+            status_surface = render_text(game_status_text, 20, (255, 0, 0))
+            screen.blit(status_surface, (10, eval_bar_y + eval_bar_height + 50))
+
+        # Candidate lines of the MultiPV mode
+        for index, (score, depth, san) in enumerate(self.analysis_lines):
+            line_text = f"{index + 1}. {format_score(score)} (depth {depth}) {san}"
+            line_surface = render_text(fit_text(line_text, 18, text_width), 18, (0, 0, 0))
+            screen.blit(line_surface, (10, eval_bar_y + eval_bar_height + 70 + index * 16))
+
+        self.perf_hud.draw(screen, self.perf_hud_rect)
+
+        screen.set_clip(None)
+        draw_time = time.perf_counter() - frame_started
+        self.render_scheduler.present()
+
+        # Drawing and pushing the frame, the wait of the frame cap is not included
+        render_time = draw_time + self.render_scheduler.update_time
+        self.journal.record(RENDER, ply=self.board.ply(), value=int(render_time * 1000000))
+        self.perf_hud.record_frame(render_time)
+
+    @traced("engine")
+    def handle_stockfish_move(self):
+        with self.board_lock:
+            if self.board.turn != chess.BLACK:
+                print("It's not Black's turn, returning early.")
+                return  # Stockfish should only move for Black
+
+            position = self.board.copy()
+            pondered_reply = self.pondered_replies.pop(position_key(position), None)
+            self.move_requested = time.monotonic()
+            self.move_pondered = pondered_reply is not None
+
+        # The reply is shown after STOCKFISH_MOVE_DELAY without blocking the window,
+        # a pondered one needs no search at all
+        if pondered_reply is not None:
+            print(f"Using the pondered reply {pondered_reply}")
+            self.engine_worker.deliver(pondered_reply, self.apply_stockfish_move, delay=STOCKFISH_MOVE_DELAY)
+            return
+        self.engine_worker.submit(lambda engine: get_stockfish_best_move(engine, position), self.apply_stockfish_move, delay=STOCKFISH_MOVE_DELAY)
+
+    @traced("engine")
+    def apply_stockfish_move(self, best_move):
+        with self.board_lock:
+            print(f"Stockfish best move: {best_move}")
+
+            before = set(self.board.piece_map().items())
+            if self.session.apply_engine_move(best_move):
+                latency = time.monotonic() - self.move_requested if self.move_requested else 0.0
+                self.journal.record(ENGINE_REPLY, ply=self.board.ply(), move=self.session.history[-1],
+                                    value=int(latency * 1000), flags=int(self.move_pondered), line=self.session.current_line_id)
+                self.perf_hud.record_reply(latency)
+                self.board_changed(before)
+                self.analyze_with_stockfish()
 
-                    if board.turn == chess.BLACK:
-                        print("Opening phase ended, Black's turn, triggering Stockfish...")
-                        handle_stockfish_move()
+                # Ensure Stockfish continues to move if it's still Black's turn
+                if self.session.engine_to_move():
+                    self.handle_stockfish_move()
                 else:
-                    print("Opening sequence completed. Switching to Stockfish control.")
-                    if board.turn == chess.BLACK:
-                        handle_stockfish_move()
-            else:
-                print(f"Incorrect move. Expected: {expected_move}, but got: {uci_move}")
-        else:
-            if uci_move in [move.uci() for move in board.legal_moves]:
-                if board.piece_at(move.from_square).piece_type == chess.PAWN and chess.square_rank(move.to_square) in [0, 7]:
-                    move.promotion = chess.QUEEN  # Promote to queen by default
-                board.push(chess.Move.from_uci(uci_move))
-
-                # Immediate board update after move
-                board_surface = render_board_surface()
-                draw_board(selected_square)
-
-                # Analyze and move for Black immediately after the player's move
-                analyze_with_stockfish_and_render()
-
-                if board.turn == chess.BLACK:
-                    time.sleep(1)  # Introduce a delay before Stockfish makes its move
-                    best_move = stockfish.get_best_move()
-                    if best_move and board.turn == chess.BLACK:
-                        board.push_uci(best_move)
-                        analyze_with_stockfish_and_render()
-                    else:
-                        print("No valid move returned by Stockfish or Stockfish tried to move White's pieces.")
+                    self.ponder()
             else:
-                print(f"Move {uci_move} is illegal. Ignoring.")
-
-dragging = False
-clicking = False  # New flag to distinguish between clicking and dragging
-dragged_piece = None
-selected_square = None
-possible_moves = None
-click_start_pos = None
-
-while running:
-    mouse_pos = pygame.mouse.get_pos()
-    for event in pygame.event.get():
-        if event.type == pygame.QUIT:
-            running = False
-            pygame.quit()
-            sys.exit()
-
-        elif event.type == pygame.MOUSEBUTTONDOWN:
-            # Start the click action
-            x, y = event.pos
-            if MARGIN <= x < SIZE[0] - MARGIN and MARGIN <= y < BOARD_SIZE - MARGIN:
-                col = int((x - MARGIN) // SQUARE_SIZE)
-                row = int(7 - (y - MARGIN) // SQUARE_SIZE)
-                square = chess.square(col, row)
-
-                piece = board.piece_at(square)
-                
-                if piece is not None and piece.color == chess.WHITE and board.turn == chess.WHITE:
-                    # If the clicked square has a piece, select it and show possible moves
-                    selected_square = square
-                    possible_moves = [move.to_square for move in board.legal_moves if move.from_square == selected_square]
-                    clicking = True
-                    click_start_pos = (x, y)
-                elif selected_square is not None and square in possible_moves:
-                    # If a piece is selected and the clicked square is a valid move, make the move
-                    move = chess.Move(selected_square, square)
-                    if move in board.legal_moves:
-                        uci_move = move.uci()
-                        process_player_move(uci_move)
-                        selected_square = None
-                        possible_moves = None
+                print(f"Illegal move by Stockfish: {best_move} in {self.board.fen()}")
+
+    @traced("move")
+    def process_player_move(self, uci_move):
+        with self.board_lock:
+            before = set(self.board.piece_map().items())
+            result = self.session.play_move(uci_move)
+
+            if not result.accepted:
+                if result.reason == NOT_YOUR_TURN:
+                    print("It's not White's turn, returning early.")
+                elif result.reason == NOT_IN_BOOK:
+                    print(f"Incorrect move. Expected one of: {', '.join(result.expected_moves)}, but got: {uci_move}")
+                    # The current line's move is the one that was expected, any book move if it has none here
+                    expected = self.session.current_line_move()
+                    expected_code = expected[0] if expected else encode_uci(result.expected_moves[0])
+                    self.journal.record(WRONG_MOVE, ply=self.board.ply(), move=encode_uci(uci_move), other=expected_code,
+                                        flags=len(result.expected_moves), line=self.session.current_line_id)
                 else:
-                    # Deselect if clicking on an empty square or invalid square
-                    selected_square = None
-                    possible_moves = None
-
-        elif event.type == pygame.MOUSEMOTION:
-            if clicking:
-                # Detect if movement exceeds a threshold, then switch to dragging
-                if click_start_pos and (abs(event.pos[0] - click_start_pos[0]) > 10 or abs(event.pos[1] - click_start_pos[1]) > 10):
-                    dragging = True
-                    dragged_piece = selected_square
-                    clicking = False  # Cancel clicking when dragging starts
-
-        elif event.type == pygame.MOUSEBUTTONUP:
-            if dragging:
-                # Calculate the destination square
-                x, y = event.pos
-                col = int((x - MARGIN) // SQUARE_SIZE)
-                row = int(7 - (y - MARGIN) // SQUARE_SIZE)
-                destination_square = chess.square(col, row)
-
-                move = chess.Move(dragged_piece, destination_square)
-                if move in board.legal_moves:
-                    uci_move = move.uci()
-                    process_player_move(uci_move)
-
-                dragging = False
-                dragged_piece = None
-
-            elif clicking and selected_square is not None:
-                # Handle click-to-move when releasing the mouse button
-                x, y = event.pos
-                col = int((x - MARGIN) // SQUARE_SIZE)
-                row = int(7 - (y - MARGIN) // SQUARE_SIZE)
-                target_square = chess.square(col, row)
-
-                if target_square in possible_moves:
-                    move = chess.Move(selected_square, target_square)
-                    if move in board.legal_moves:
-                        uci_move = move.uci()
-                        process_player_move(uci_move)
-
-            # Reset dragging and clicking state
-            dragging = False
-            clicking = False
-            dragged_piece = None
-
-    # Draw the board and any other UI elements
-    draw_board(selected_square, dragged_piece, mouse_pos, possible_moves)
-
-pygame.quit()
+                    print(f"Move {uci_move} is illegal. Ignoring.")
+                return result
+
+            # The session's history has the moves as played, a promotion included
+            book_move = result.book_reply is not None or result.opening_completed
+            think_time = int((time.monotonic() - self.turn_started) * 1000)
+            player_ply = self.board.ply() - (2 if result.book_reply else 1)
+            self.journal.record(PLAYER_MOVE, ply=player_ply, move=self.session.history[player_ply],
+                                value=think_time, flags=int(book_move), line=self.session.current_line_id)
+            if result.book_reply:
+                self.journal.record(BOOK_REPLY, ply=self.board.ply() - 1, move=self.session.history[-1], line=self.session.current_line_id)
+
+            self.engine_worker.cancel()  # Pending analysis belongs to the previous position
+            self.board_changed(before)
+            self.selected_square = None
+            self.possible_moves = None
+
+            if result.switched_line:
+                print(f"Switched to {self.session.line_name}")
+            if result.opening_completed:
+                print("Opening sequence completed. Switching to Stockfish control.")
+
+            # Analyze and ask for Black's reply without waiting for either
+            self.analyze_with_stockfish()
+
+            if result.engine_to_move:
+                self.handle_stockfish_move()
+            else:
+                self.ponder()
+            return result
+
+    def handle_mouse_down(self, event):
+        # Start the click action
+        x, y = self.to_pixels(event.pos)
+        square = self.board_renderer.square_at((x, y))
+        if square is not None:
+            piece = self.board.piece_at(square)
+
+            if piece is not None and piece.color == chess.WHITE and self.board.turn == chess.WHITE:
+                # If the clicked square has a piece, select it and show possible moves
+                self.selected_square = square
+                self.possible_moves = self.session.snapshot.targets.get(square, set())
+                self.clicking = True
+                self.click_start_pos = (x, y)
+            elif self.selected_square is not None and square in self.possible_moves:
+                # If a piece is selected and the clicked square is a valid move, make the move
+                self.process_player_move(chess.Move(self.selected_square, square).uci())
+                self.selected_square = None
+                self.possible_moves = None
+            else:
+                # Deselect if clicking on an empty square or invalid square
+                self.selected_square = None
+                self.possible_moves = None
+
+    def handle_mouse_motion(self, event):
+        if self.clicking:
+            # Detect if movement exceeds a threshold, then switch to dragging
+            x, y = self.to_pixels(event.pos)
+            if self.click_start_pos and (abs(x - self.click_start_pos[0]) > 10 or abs(y - self.click_start_pos[1]) > 10):
+                self.dragging = True
+                self.dragged_piece = self.selected_square
+                self.clicking = False  # Cancel clicking when dragging starts
+
+    def handle_mouse_up(self, event):
+        if self.dragging:
+            # Calculate the destination square
+            destination_square = self.board_renderer.square_at(self.to_pixels(event.pos))
+
+            if destination_square is not None and self.session.snapshot.is_legal_target(self.dragged_piece, destination_square):
+                self.process_player_move(chess.Move(self.dragged_piece, destination_square).uci())
+
+        elif self.clicking and self.selected_square is not None:
+            # Handle click-to-move when releasing the mouse button
+            target_square = self.board_renderer.square_at(self.to_pixels(event.pos))
+
+            if target_square is not None and target_square in self.possible_moves:
+                self.process_player_move(chess.Move(self.selected_square, target_square).uci())
+
+        # Reset dragging and clicking state
+        self.dragging = False
+        self.clicking = False
+        self.dragged_piece = None
+
+    def quit(self):
+        self.engine_worker.stop()
+        self.eval_cache.save()
+        self.journal.close()
+        if tracer.enabled:
+            self.write_trace()
+        pygame.quit()
+
+    # Main game loop
+    def run(self):
+        while True:
+            # A running animation keeps the loop from waiting on events
+            self.advance_animation()
+
+            previous_selection = (self.selected_square, self.possible_moves)
+            # While the window is being resized the loop wakes up to lay it out once it settles
+            timeout = None
+            if self.resize_due is not None:
+                timeout = max(self.resize_due - time.monotonic(), 0.0)
+            with tracer.span("wait for events", "loop"):
+                events = self.render_scheduler.get_events(timeout)
+            self.perf_hud.begin_frame()
+            for event in events:
+                if event.type == pygame.QUIT:
+                    self.quit()
+                    return
+
+                elif event.type == ENGINE_EVENT:
+                    # Results from the engine worker are applied on the pygame thread
+                    self.engine_worker.dispatch(event)
+
+                elif event.type == pygame.VIDEORESIZE:
+                    # Dragging a window edge sends a stream of sizes, only the last one is rasterized
+                    self.resize_due = time.monotonic() + RESIZE_SETTLE
+
+                elif event.type == pygame.KEYDOWN and event.key == pygame.K_m:
+                    self.toggle_multipv()
+
+                elif event.type == pygame.KEYDOWN and event.key == pygame.K_F3:
+                    self.toggle_perf_hud()
+
+                elif event.type == pygame.KEYDOWN and event.key == pygame.K_F4:
+                    self.write_trace()
+
+                elif event.type == pygame.MOUSEBUTTONDOWN:
+                    self.handle_mouse_down(event)
+
+                elif event.type == pygame.MOUSEMOTION:
+                    self.handle_mouse_motion(event)
+
+                elif event.type == pygame.MOUSEBUTTONUP:
+                    self.handle_mouse_up(event)
+
+            if self.resize_due is not None and time.monotonic() >= self.resize_due:
+                self.resize_due = None
+                self.layout()
+
+            mouse_pos = self.to_pixels(pygame.mouse.get_pos())
+
+            # Mark the old and new selection dots when the selection changed
+            if previous_selection != (self.selected_square, self.possible_moves):
+                self.mark_selection_dirty(*previous_selection)
+                self.mark_selection_dirty(self.selected_square, self.possible_moves)
+
+            # The dragged sprite needs its old and new position redrawn
+            current_drag_rect = self.drag_rect(mouse_pos) if self.dragged_piece is not None else None
+            if current_drag_rect != self.last_drag_rect:
+                self.render_scheduler.mark(self.last_drag_rect)
+                self.render_scheduler.mark(current_drag_rect)
+                self.last_drag_rect = current_drag_rect
+
+            # Draw the board and any other UI elements
+            if not self.render_scheduler.is_idle():
+                self.draw_board(self.selected_square, self.dragged_piece, mouse_pos, self.possible_moves)
+
+
+def load_openings():
+    from openings import openings
+    return openings
+
+
+def start_engine_pool():
+    # Returns at once, the engine processes start on the pool's own thread
+    return EnginePool(
+        STOCKFISH_PATH,
+        size=STOCKFISH_POOL_SIZE,
+        options={
+            "Hash": STOCKFISH_HASH_MB,
+            "Threads": STOCKFISH_THREADS,
+            "Skill Level": STOCKFISH_SKILL_LEVEL,
+        },
+        wait=False,
+    )
+
+
+def main():
+    # Real pixels instead of a scaled up window on Windows displays with a scale factor
+    os.environ.setdefault("SDL_WINDOWS_DPI_AWARENESS", "permonitorv2")
+    pygame.init()
+    if TRACE_ENABLED:
+        tracer.start(TRACE_BUFFER_EVENTS)
+
+    # Stockfish starts in the background while the opening selector is on screen
+    engine_pool = start_engine_pool()
+
+    # The binary book is memory mapped, the openings dict is only imported without one and
+    # then indexed in the background as well, the selector only needs the opening names
+    opening_names, opening_book = start_opening_book(OPENING_BOOK_PATH, load_openings, REPERTOIRE_CACHE_PATH)
+
+    from opening_selector import select_opening
+    selected_opening = select_opening(opening_names)
+
+    trainer = ChessTrainer(opening_book.result(), selected_opening, engine_pool)
+    trainer.run()
+
+
+if __name__ == "__main__":
+    main()
+    sys.exit()
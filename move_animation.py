@@ -0,0 +1,59 @@
+import chess
+
+# Moves slide into place over a fixed number of frames. Everything a frame needs is
+# computed when the move is made: the board without the moving pieces and the position
+# of every moving sprite on every frame, so drawing a frame is a few blits.
+
+
+def move_paths(board, move):
+    # (piece, from square, to square) for every piece the move carries, board is the position before the move
+    piece = board.piece_at(move.from_square)
+    if piece is None:
+        return []
+    if move.promotion:
+        piece = chess.Piece(move.promotion, piece.color)
+    paths = [(piece, move.from_square, move.to_square)]
+
+    # The rook of a castling move slides at the same time as the king
+    if board.is_castling(move):
+        rank = chess.square_rank(move.from_square)
+        if board.is_kingside_castling(move):
+            paths.append((chess.Piece(chess.ROOK, piece.color), chess.square(7, rank), chess.square(5, rank)))
+        else:
+            paths.append((chess.Piece(chess.ROOK, piece.color), chess.square(0, rank), chess.square(3, rank)))
+    return paths
+
+
+class MoveAnimation:
+    def __init__(self, static, paths, renderer, frame_count):
+        self.static = static  # Board after the move without the pieces that are still sliding
+        self.sprite_size = renderer.atlas.size
+        self.squares = {square for _, from_square, to_square in paths for square in (from_square, to_square)}
+        self.frame = -1  # Not started yet
+
+        self.frames = []
+        for index in range(1, frame_count + 1):
+            # Ease out, the piece slows down as it lands
+            t = 1 - (1 - index / frame_count) ** 2
+            sprites = []
+            for piece, from_square, to_square in paths:
+                start = renderer.piece_position(from_square)
+                end = renderer.piece_position(to_square)
+                sprites.append((piece, (round(start[0] + (end[0] - start[0]) * t), round(start[1] + (end[1] - start[1]) * t))))
+            self.frames.append(sprites)
+
+    @property
+    def started(self):
+        return self.frame >= 0
+
+    @property
+    def done(self):
+        return self.frame >= len(self.frames)
+
+    def sprites(self):
+        if not self.started or self.done:
+            return []
+        return self.frames[self.frame]
+
+    def rects(self):
+        return [(pos[0], pos[1], self.sprite_size, self.sprite_size) for piece, pos in self.sprites()]
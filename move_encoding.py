@@ -0,0 +1,23 @@
+import chess
+
+# Moves packed into 16 bits with the Polyglot layout: the to square in bits 0-5, the from
+# square in bits 6-11 and the promotion piece in bits 12-14 (1 = knight ... 4 = queen).
+# Lines and move histories are kept as array('H') of these codes and compared as integers.
+
+
+def encode_move(move):
+    promotion = move.promotion - 1 if move.promotion else 0
+    return move.to_square | move.from_square << 6 | promotion << 12
+
+
+def encode_uci(uci_move):
+    return encode_move(chess.Move.from_uci(uci_move))
+
+
+def decode_move(code):
+    promotion = code >> 12 & 7
+    return chess.Move(code >> 6 & 63, code & 63, promotion + 1 if promotion else None)
+
+
+def decode_uci(code):
+    return decode_move(code).uci()
@@ -0,0 +1,135 @@
+import os
+import sys
+import json
+import struct
+import threading
+import concurrent.futures
+from array import array
+import chess
+import chess.polyglot
+from opening_index import OpeningIndex, LineRecord, build_opening_index
+from move_encoding import encode_move
+from repertoire_cache import load_repertoire_cache
+
+# The book is a Polyglot .bin file: big endian (zobrist key, move, weight, learn) records sorted by key,
+# one per book move of a position, weighted by the number of lines that play it. The learn field is
+# the offset of the move's line ids in the .ids sidecar (a count, then the ids), line names live in
+# the .lines sidecar next to the book:
+#   python opening_book.py [opening_book.bin]
+# builds it from the openings dict, the trainer then uses it instead of replaying the lines.
+
+RECORD = struct.Struct(">QHHI")
+
+
+def lines_path(book_path):
+    return book_path + ".lines"
+
+
+def ids_path(book_path):
+    return book_path + ".ids"
+
+
+def encode_book_move(board, move):
+    # Same layout as the move codes, except that Polyglot writes castling as king takes rook
+    if board.is_castling(move):
+        rank = chess.square_rank(move.from_square)
+        move = chess.Move(move.from_square, chess.square(7 if board.is_kingside_castling(move) else 0, rank))
+    return encode_move(move)
+
+
+def write_book(openings, book_path):
+    book_moves = {}  # (zobrist key, book move) -> ids of the lines that play it
+    lines = []
+    for opening_name, opening_lines in openings.items():
+        for line in opening_lines:
+            line_id = len(lines)
+            board = chess.Board()
+            for ply, uci_move in enumerate(line["moves"]):
+                try:
+                    move = board.parse_uci(uci_move)
+                except ValueError:
+                    print(f"Illegal move {uci_move} at ply {ply + 1} of {line['name']}, the rest of the line is ignored")
+                    break
+                book_moves.setdefault((chess.polyglot.zobrist_hash(board), encode_book_move(board, move)), []).append(line_id)
+                board.push(move)
+            # Only the plies up to an illegal move are in the book
+            lines.append({"opening": opening_name, "name": line["name"], "plies": board.ply()})
+
+    line_ids = array("I")
+    with open(book_path, "wb") as f:
+        for key, code in sorted(book_moves):
+            move_lines = book_moves[key, code]
+            f.write(RECORD.pack(key, code, min(len(move_lines), 0xFFFF), len(line_ids)))
+            line_ids.append(len(move_lines))
+            line_ids.extend(move_lines)
+    with open(ids_path(book_path), "wb") as f:
+        f.write(line_ids.tobytes())
+    with open(lines_path(book_path), "w", encoding="utf-8") as f:
+        for line in lines:
+            f.write(json.dumps(line) + "\n")
+    return len(book_moves), len(lines)
+
+
+class OpeningBook(OpeningIndex):
+    # Same continuations as OpeningIndex, answered by binary search over the memory mapped book
+
+    def __init__(self, book_path):
+        super().__init__()
+        self.reader = chess.polyglot.open_reader(book_path)
+        with open(lines_path(book_path), encoding="utf-8") as f:
+            self.lines = [LineRecord(**json.loads(line)) for line in f if line.strip()]
+        self.line_ids = array("I")
+        with open(ids_path(book_path), "rb") as f:
+            self.line_ids.frombytes(f.read())
+
+    def continuations(self, board, active_lines=None):
+        # One entry per book move, so the legality checks of find_all() do not grow with the lines.
+        # Positions reached by transposition have the same key, the ply is taken from the board
+        book_moves = {}
+        ply = board.ply()
+        for entry in self.reader.find_all(board):
+            start = entry.learn + 1
+            move_lines = self.line_ids[start:start + self.line_ids[entry.learn]]
+            if active_lines is not None:
+                move_lines = [line_id for line_id in move_lines if line_id in active_lines]
+            if move_lines:
+                book_moves[encode_move(entry.move)] = dict.fromkeys(move_lines, ply)
+        return book_moves
+
+    def close(self):
+        self.reader.close()
+
+
+def index_openings(openings, cache_path=None):
+    # The positions written by validate_repertoire.py, only without them the lines are replayed
+    cache = load_repertoire_cache(cache_path, openings)
+    if cache is not None:
+        return cache.build_index()
+    return build_opening_index(openings)
+
+
+def start_opening_book(book_path, openings_loader, cache_path=None):
+    # Returns the opening names and a future of the book. The binary book is memory mapped right
+    # away, without one the index is built on a background thread while the selector is on screen
+    book = concurrent.futures.Future()
+    if all(os.path.exists(path) for path in (book_path, lines_path(book_path), ids_path(book_path))):
+        book.set_result(OpeningBook(book_path))
+        return list(dict.fromkeys(line.opening for line in book.result().lines)), book
+
+    openings = openings_loader()
+
+    def build():
+        try:
+            book.set_result(index_openings(openings, cache_path))
+        except Exception as e:
+            book.set_exception(e)
+
+    threading.Thread(target=build, name="opening-book", daemon=True).start()
+    return [opening_name for opening_name, lines in openings.items() if lines], book
+
+if __name__ == "__main__":
+    from openings import openings
+    from config import OPENING_BOOK_PATH
+    path = sys.argv[1] if len(sys.argv) > 1 else OPENING_BOOK_PATH
+    record_count, line_count = write_book(openings, path)
+    print(f"Wrote {record_count} book moves for {line_count} lines to {path}")
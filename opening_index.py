@@ -0,0 +1,119 @@
+from array import array
+from bisect import bisect_left
+import chess
+import chess.polyglot
+from move_encoding import encode_move
+
+
+class LineRecord:
+    __slots__ = ("opening", "name", "plies")
+
+    def __init__(self, opening, name, plies):
+        self.opening = opening
+        self.name = name
+        self.plies = plies
+
+
+class OpeningIndex:
+    # Book continuations of every position in the repertoire, merged across all lines so lines
+    # that transpose into each other share their position. Everything lives in flat arrays:
+    # the moves of line i are the 16 bit codes moves[offsets[i]:offsets[i + 1]] of move_encoding.py.
+    # position_keys holds the sorted zobrist keys of the positions, the lines that play a move
+    # from position j are position_lines[position_starts[j]:position_starts[j + 1]], with the
+    # ply of that move in the line at the same place in position_plies.
+
+    def __init__(self):
+        self.lines = []  # line id -> LineRecord
+        self.moves = array("H")
+        self.offsets = array("I", [0])
+        self.keys = array("Q")  # Zobrist key before each move, only used while building
+        self.position_keys = array("Q")
+        self.position_starts = array("I", [0])
+        self.position_lines = array("I")
+        self.position_plies = array("H")
+        self.trie = {}  # move code -> (zobrist key after the move, child trie), only used while building
+
+    def add_line(self, opening_name, line):
+        line_id = len(self.lines)
+        record = LineRecord(opening_name, line["name"], 0)
+        self.lines.append(record)
+
+        board = chess.Board()
+        key = chess.polyglot.zobrist_hash(board)
+        node = self.trie
+        for ply, uci_move in enumerate(line["moves"]):
+            try:
+                move = board.parse_uci(uci_move)
+            except ValueError:
+                print(f"Illegal move {uci_move} at ply {ply + 1} of {line['name']}, the rest of the line is ignored")
+                break
+            code = encode_move(move)
+            self.moves.append(code)
+            self.keys.append(key)
+            board.push(move)
+
+            # Lines share their prefixes, so most positions are hashed only once
+            child = node.get(code)
+            if child is None:
+                child = (chess.polyglot.zobrist_hash(board), {})
+                node[code] = child
+            key, node = child
+        self.offsets.append(len(self.moves))
+        record.plies = self.offsets[-1] - self.offsets[-2]  # Only the plies up to an illegal move are in the book
+        return line_id
+
+    def finish(self):
+        # Groups the moves of all lines by the position they are played from
+        line_ids = array("I")
+        plies = array("H")
+        for line_id in range(len(self.lines)):
+            count = self.offsets[line_id + 1] - self.offsets[line_id]
+            line_ids.extend(array("I", [line_id]) * count)
+            plies.extend(range(count))
+
+        keys = self.keys
+        order = sorted(range(len(keys)), key=keys.__getitem__)
+        self.position_lines = array("I", [line_ids[index] for index in order])
+        self.position_plies = array("H", [plies[index] for index in order])
+        self.position_keys = array("Q")
+        self.position_starts = array("I")
+        previous = None
+        for start, index in enumerate(order):
+            if keys[index] != previous:
+                previous = keys[index]
+                self.position_keys.append(previous)
+                self.position_starts.append(start)
+        self.position_starts.append(len(order))
+
+        # The keys of every ply and the build trie are not needed for lookups
+        self.keys = array("Q")
+        self.trie = {}
+
+    def opening_lines(self, opening_name):
+        # Line ids of one opening, sessions pass them as active_lines so the index stays shared
+        return frozenset(line_id for line_id, line in enumerate(self.lines) if line.opening == opening_name)
+
+    def continuations(self, board, active_lines=None):
+        # Book moves of the position as {move code: {line id: ply of that move in the line}},
+        # only those of active_lines unless it is None
+        key = chess.polyglot.zobrist_hash(board)
+        position = bisect_left(self.position_keys, key)
+        if position == len(self.position_keys) or self.position_keys[position] != key:
+            return {}
+
+        book_moves = {}
+        for entry in range(self.position_starts[position], self.position_starts[position + 1]):
+            line_id = self.position_lines[entry]
+            if active_lines is None or line_id in active_lines:
+                ply = self.position_plies[entry]
+                book_moves.setdefault(self.moves[self.offsets[line_id] + ply], {})[line_id] = ply
+        return book_moves
+
+
+def build_opening_index(openings):
+    index = OpeningIndex()
+    for opening_name, lines in openings.items():
+        for line in lines:
+            index.add_line(opening_name, line)
+    index.finish()
+    return index
@@ -1,31 +1,186 @@
+import sys
 import pygame
+from text_cache import render_text
 
-def select_opening(openings):
-    pygame.init()
-    opening_selected = None
-    font = pygame.font.Font(None, 36)
-    select_screen = pygame.display.set_mode((400, 300))
-    pygame.display.set_caption('Select Opening')
+# Picks the opening to train. The window sleeps until an event arrives, only the rows that are
+# on screen are drawn and typing filters the names, so thousands of openings stay responsive:
+# type to search, Backspace and Escape edit the search, arrows, Page Up/Down, Home/End and the
+# mouse wheel scroll, Enter or a click picks an opening.
+
+SELECTOR_SIZE = (480, 400)
+HEADER_HEIGHT = 44
+ROW_HEIGHT = 32
+TEXT_SIZE = 26
+BACKGROUND_COLOR = (255, 255, 255)
+HEADER_COLOR = (235, 235, 235)
+HIGHLIGHT_COLOR = (200, 220, 255)
+TEXT_COLOR = (0, 0, 0)
+HINT_COLOR = (120, 120, 120)
+
+
+class OpeningSelector:
+    def __init__(self, openings):
+        self.names = list(openings)
+        self.search_keys = [name.lower() for name in self.names]  # Built once, searched on every key press
+        self.query = ""
+        self.matches = list(range(len(self.names)))  # Indexes into names that contain the query
+        self.highlighted = 0  # Position in matches
+        self.scroll = 0  # First match shown
+        self.screen = None
+        self.dirty = True
+
+    def visible_rows(self):
+        return max((self.screen.get_height() - HEADER_HEIGHT) // ROW_HEIGHT, 1)
+
+    def set_query(self, query):
+        # A query that contains the previous one only narrows its matches, anything else searches all names
+        query_key = query.lower()
+        if self.query.lower() in query_key:
+            candidates = self.matches
+        else:
+            candidates = range(len(self.names))
+        self.matches = [index for index in candidates if query_key in self.search_keys[index]]
+        self.query = query
+        self.highlighted = 0
+        self.scroll = 0
+        self.dirty = True
+
+    def move_highlight(self, offset):
+        if not self.matches:
+            return
+        self.highlighted = max(0, min(self.highlighted + offset, len(self.matches) - 1))
+        # Keep the highlighted row on screen
+        rows = self.visible_rows()
+        if self.highlighted < self.scroll:
+            self.scroll = self.highlighted
+        elif self.highlighted >= self.scroll + rows:
+            self.scroll = self.highlighted - rows + 1
+        self.dirty = True
+
+    def scroll_by(self, rows):
+        last = max(len(self.matches) - self.visible_rows(), 0)
+        scroll = max(0, min(self.scroll + rows, last))
+        if scroll != self.scroll:
+            self.scroll = scroll
+            self.dirty = True
+
+    def row_at(self, pos):
+        # Position in matches of the row under the mouse, None outside the list
+        if pos[1] < HEADER_HEIGHT:
+            return None
+        position = self.scroll + (pos[1] - HEADER_HEIGHT) // ROW_HEIGHT
+        if position < len(self.matches):
+            return position
+        return None
 
-    while opening_selected is None:
-        select_screen.fill((255, 255, 255))
-        y = 50
+    def selected(self):
+        if not self.matches:
+            return None
+        return self.names[self.matches[self.highlighted]]
 
-        for opening_name in openings:  # Directly iterate over the dict_keys object
-            text = font.render(opening_name, True, (0, 0, 0))
-            select_screen.blit(text, (50, y))
-            y += 50
+    def draw(self):
+        screen = self.screen
+        width = screen.get_width()
+        screen.fill(BACKGROUND_COLOR)
+
+        # Search line and how many openings match it
+        pygame.draw.rect(screen, HEADER_COLOR, (0, 0, width, HEADER_HEIGHT))
+        if self.query:
+            search_surface = render_text(f"Search: {self.query}", TEXT_SIZE, TEXT_COLOR)
+        else:
+            search_surface = render_text("Type to search", TEXT_SIZE, HINT_COLOR)
+        screen.blit(search_surface, (10, (HEADER_HEIGHT - search_surface.get_height()) // 2))
+        count_surface = render_text(f"{len(self.matches)} / {len(self.names)}", 20, HINT_COLOR)
+        screen.blit(count_surface, (width - count_surface.get_width() - 10, (HEADER_HEIGHT - count_surface.get_height()) // 2))
+
+        # Only the rows on screen are rendered, from the shared text cache
+        last = min(self.scroll + self.visible_rows(), len(self.matches))
+        for position in range(self.scroll, last):
+            y = HEADER_HEIGHT + (position - self.scroll) * ROW_HEIGHT
+            if position == self.highlighted:
+                pygame.draw.rect(screen, HIGHLIGHT_COLOR, (0, y, width, ROW_HEIGHT))
+            text = render_text(self.names[self.matches[position]], TEXT_SIZE, TEXT_COLOR)
+            screen.blit(text, (10, y + (ROW_HEIGHT - text.get_height()) // 2))
+
+        if not self.matches:
+            text = render_text("No opening matches the search", 20, HINT_COLOR)
+            screen.blit(text, (10, HEADER_HEIGHT + 10))
 
         pygame.display.flip()
+        self.dirty = False
+
+    def handle_key(self, event):
+        # Returns the chosen opening when Enter was pressed
+        if event.key in (pygame.K_RETURN, pygame.K_KP_ENTER):
+            return self.selected()
+        if event.key == pygame.K_BACKSPACE:
+            if self.query:
+                self.set_query(self.query[:-1])
+        elif event.key == pygame.K_ESCAPE:
+            if self.query:
+                self.set_query("")
+        elif event.key == pygame.K_UP:
+            self.move_highlight(-1)
+        elif event.key == pygame.K_DOWN:
+            self.move_highlight(1)
+        elif event.key == pygame.K_PAGEUP:
+            self.move_highlight(-self.visible_rows())
+        elif event.key == pygame.K_PAGEDOWN:
+            self.move_highlight(self.visible_rows())
+        elif event.key == pygame.K_HOME:
+            self.move_highlight(-len(self.matches))
+        elif event.key == pygame.K_END:
+            self.move_highlight(len(self.matches))
+        return None
+
+    def handle_event(self, event):
+        # Returns the chosen opening, None while the trainee is still choosing
+        if event.type == pygame.QUIT:
+            pygame.quit()
+            sys.exit()
+        elif event.type == pygame.TEXTINPUT:
+            self.set_query(self.query + event.text)
+        elif event.type == pygame.KEYDOWN:
+            return self.handle_key(event)
+        elif event.type == pygame.MOUSEWHEEL:
+            self.scroll_by(-event.y * 3)
+        elif event.type == pygame.MOUSEMOTION:
+            position = self.row_at(event.pos)
+            if position is not None and position != self.highlighted:
+                self.highlighted = position
+                self.dirty = True
+        elif event.type == pygame.MOUSEBUTTONDOWN and event.button == 1:
+            position = self.row_at(event.pos)
+            if position is not None:
+                self.highlighted = position
+                return self.selected()
+        elif event.type == pygame.VIDEORESIZE:
+            self.screen = pygame.display.get_surface()
+            self.scroll_by(0)
+            self.dirty = True
+        elif event.type in (pygame.WINDOWEXPOSED, pygame.WINDOWRESTORED):
+            self.dirty = True
+        return None
 
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT:
-                pygame.quit()
-                exit()
-            elif event.type == pygame.MOUSEBUTTONDOWN:
-                x, y = event.pos
-                selected_index = (y - 50) // 50
-                if 0 <= selected_index < len(openings):
-                    opening_selected = list(openings)[selected_index]
-
-    return opening_selected
+    def run(self):
+        self.screen = pygame.display.set_mode(SELECTOR_SIZE, pygame.RESIZABLE)
+        pygame.display.set_caption('Select Opening')
+        pygame.key.start_text_input()
+        pygame.key.set_repeat(400, 40)
+        try:
+            while True:
+                if self.dirty:
+                    self.draw()
+                # Sleep inside SDL until something happens, then handle everything that is queued
+                for event in [pygame.event.wait()] + pygame.event.get():
+                    opening_selected = self.handle_event(event)
+                    if opening_selected is not None:
+                        return opening_selected
+        finally:
+            pygame.key.stop_text_input()
+            pygame.key.set_repeat()
+
+
+def select_opening(openings):
+    pygame.init()
+    return OpeningSelector(openings).run()
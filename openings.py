@@ -1,3 +1,7 @@
+import os
+import json
+from config import REPERTOIRE_PATH
+
 openings = {
     "Ruy Lopez": [
         {"name": "Ruy Lopez: Morphy Defense, Closed", "moves": ["e2e4", "e7e5", "g1f3", "b8c6", "f1b5", "a7a6", "b5a4", "g8f6", "e1g1", "f8e7", "d2d4", "e5d4", "f3d4"]},
@@ -30,5 +34,23 @@ openings = {
 }
 
 
+def load_repertoire(path):
+    repertoire = {}
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                entry = json.loads(line)
+                repertoire.setdefault(entry["opening"], []).append({"name": entry["name"], "moves": entry["moves"]})
+    return repertoire
+
+
+# The lines above, whatever repertoire file is installed, e.g. for benchmark.py
+builtin_openings = openings
+
+# Written by pgn_import.py, used instead of the lines above when it exists
+if os.path.exists(REPERTOIRE_PATH):
+    openings = load_repertoire(REPERTOIRE_PATH)
+
+
 def get_random_opening_line(opening_name):
       return openings[opening_name]
\ No newline at end of file
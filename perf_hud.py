@@ -0,0 +1,178 @@
+import time
+from array import array
+import pygame
+from tracing import tracer
+
+# Performance overlay of the trainer: frame times of the last FRAME_SAMPLES frames as a histogram,
+# the last board render, engine latency and depth, time spent waiting for the board lock and
+# the hit rates of the caches. Recording a frame is one array write, the overlay's own surface is
+# only rebuilt every refresh interval, so it can stay on while it measures the trainer.
+
+FRAME_SAMPLES = 120  # Ring buffer of frame times, one histogram bar each
+HISTOGRAM_MAX_MS = 50.0  # Frame time of a full-height bar
+HUD_WIDTH = 250
+HUD_HEIGHT = 110
+BACKGROUND_COLOR = (30, 30, 30)
+TEXT_COLOR = (220, 220, 220)
+GOOD_COLOR = (90, 200, 90)
+SLOW_COLOR = (230, 80, 60)
+TARGET_COLOR = (120, 120, 120)
+
+
+class TimedLock:
+    # Wraps a lock and adds up how long the callers waited to acquire it
+
+    def __init__(self, lock):
+        self.lock = lock
+        self.wait_time = 0.0
+        self.max_wait = 0.0
+        self.acquisitions = 0
+
+    def __enter__(self):
+        started = time.perf_counter()
+        self.lock.acquire()
+        waited = time.perf_counter() - started
+        # Updated while holding the lock, so waiting threads cannot lose a sample
+        self.wait_time += waited
+        self.acquisitions += 1
+        if waited > self.max_wait:
+            self.max_wait = waited
+        tracer.complete("board_lock", "lock", started, waited)
+        return self
+
+    def __exit__(self, *exc_info):
+        self.lock.release()
+        return False
+
+
+class PerfHud:
+    def __init__(self, target_fps=60, refresh_interval=0.25, visible=False):
+        self.visible = visible
+        self.target_fps = target_fps
+        self.refresh_interval = refresh_interval
+        self.frame_times = array("d", [0.0]) * FRAME_SAMPLES  # Seconds, written round robin
+        self.frame_index = 0
+        self.frame_count = 0
+        self.frame_started = None
+        self.render_time = 0.0
+        self.engine_latency = None  # Seconds from the analysis request to its final result
+        self.engine_depth = 0
+        self.reply_latency = None  # Seconds from the trainee's move to Black's reply
+        self.lock = None  # TimedLock of the board
+        self.lock_wait = 0.0  # Lock wait at the last refresh, the overlay shows the difference
+        self.caches = []  # (label, object with hits and misses)
+        self.font = None
+        self.surface = None
+        self.refreshed = 0.0
+
+    def toggle(self):
+        self.visible = not self.visible
+        self.refreshed = 0.0
+
+    def watch_lock(self, lock):
+        self.lock = lock
+
+    def watch_cache(self, label, cache):
+        self.caches.append((label, cache))
+
+    def begin_frame(self):
+        # Called when the loop wakes up, the time it slept waiting for events is no frame time
+        self.frame_started = time.perf_counter()
+
+    def record_frame(self, render_time):
+        # A frame lasts from waking up to the presented picture: event handling, drawing and the frame cap
+        if self.frame_started is not None:
+            self.frame_times[self.frame_index] = time.perf_counter() - self.frame_started
+            self.frame_index = (self.frame_index + 1) % FRAME_SAMPLES
+            self.frame_count += 1
+            self.frame_started = None
+        self.render_time = render_time
+
+    def record_engine(self, latency, depth):
+        self.engine_latency = latency
+        self.engine_depth = depth
+
+    def record_reply(self, latency):
+        self.reply_latency = latency
+
+    def is_stale(self):
+        return self.visible and time.perf_counter() - self.refreshed >= self.refresh_interval
+
+    def rect(self, area):
+        # Top right corner of the area the trainer keeps free for the overlay
+        width = min(HUD_WIDTH, area.width)
+        height = min(HUD_HEIGHT, area.height)
+        return pygame.Rect(area.right - width, area.top, width, height)
+
+    def samples(self):
+        # Frame times in the order they were recorded, oldest first
+        count = min(self.frame_count, FRAME_SAMPLES)
+        if count < FRAME_SAMPLES:
+            return self.frame_times[:count]
+        return self.frame_times[self.frame_index:] + self.frame_times[:self.frame_index]
+
+    def text_lines(self):
+        samples = self.samples()
+        lines = []
+        if samples:
+            average = sum(samples) / len(samples)
+            lines.append(f"{1.0 / average:.0f} fps  frame {average * 1000:.1f} ms  max {max(samples) * 1000:.1f} ms")
+        else:
+            lines.append("no frames yet")
+        lines.append(f"render {self.render_time * 1000:.2f} ms")
+
+        engine = "engine -"
+        if self.engine_latency is not None:
+            engine = f"engine {self.engine_latency * 1000:.0f} ms depth {self.engine_depth}"
+        if self.reply_latency is not None:
+            engine += f"  reply {self.reply_latency * 1000:.0f} ms"
+        lines.append(engine)
+
+        if self.lock is not None:
+            waited = self.lock.wait_time - self.lock_wait
+            self.lock_wait = self.lock.wait_time
+            lines.append(f"board lock {waited * 1000:.2f} ms  max {self.lock.max_wait * 1000:.2f} ms")
+
+        rates = []
+        for label, cache in self.caches:
+            lookups = cache.hits + cache.misses
+            rates.append(f"{label} {100.0 * cache.hits / lookups:.0f}%" if lookups else f"{label} -")
+        if rates:
+            lines.append("hits " + "  ".join(rates))
+        return lines
+
+    def build(self, size):
+        # The overlay's text is not drawn through text_cache, so its numbers neither evict the
+        # panel's strings nor count towards the text cache's hit rate
+        if self.font is None:
+            self.font = pygame.font.Font(None, 16)
+        surface = pygame.Surface(size)
+        surface.fill(BACKGROUND_COLOR)
+        y = 4
+        for line in self.text_lines():
+            surface.blit(self.font.render(line, True, TEXT_COLOR), (6, y))
+            y += 13
+
+        # One bar per frame, the grey line is the frame time of the target frame rate
+        top = y + 2
+        height = max(size[1] - top - 4, 1)
+        samples = self.samples()
+        bar_width = max((size[0] - 12) // FRAME_SAMPLES, 1)
+        target = 1.0 / self.target_fps if self.target_fps else 0.0
+        for index, frame_time in enumerate(samples):
+            bar_height = max(int(min(frame_time * 1000 / HISTOGRAM_MAX_MS, 1.0) * height), 1)
+            color = SLOW_COLOR if target and frame_time > target * 1.5 else GOOD_COLOR
+            x = 6 + index * bar_width
+            pygame.draw.rect(surface, color, (x, top + height - bar_height, bar_width, bar_height))
+        if target:
+            target_y = top + height - int(min(target * 1000 / HISTOGRAM_MAX_MS, 1.0) * height)
+            pygame.draw.line(surface, TARGET_COLOR, (6, target_y), (size[0] - 6, target_y))
+        return surface
+
+    def draw(self, screen, rect):
+        if not self.visible or rect.width <= 0 or rect.height <= 0:
+            return
+        if self.surface is None or self.surface.get_size() != rect.size or self.is_stale():
+            self.surface = self.build(rect.size)
+            self.refreshed = time.perf_counter()
+        screen.blit(self.surface, rect.topleft)
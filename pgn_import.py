@@ -0,0 +1,189 @@
+import os
+import io
+import sys
+import json
+import sqlite3
+import hashlib
+import argparse
+import multiprocessing
+import chess.pgn
+from config import REPERTOIRE_PATH
+
+# Imports opening lines from PGN files into the repertoire file the trainer loads:
+#   python pgn_import.py coach.pgn eco.pgn --max-plies 16
+# Files are split into chunks on game boundaries and parsed by a process pool, duplicate lines
+# and repeated names are tracked in a temporary SQLite file next to the output, so memory use
+# depends on the chunk size and not on the size of the input.
+
+CHUNK_SIZE = 16 * 1024 * 1024
+
+
+def find_chunks(paths, chunk_size):
+    for path in paths:
+        size = os.path.getsize(path)
+        for start in range(0, max(size, 1), chunk_size):
+            yield path, start, min(start + chunk_size, size)
+
+
+def is_blank(line):
+    return not line.strip()
+
+
+def read_chunk(path, start, end):
+    # A game starts with a tag line after a blank line or at the start of the file, and
+    # belongs to the chunk that tag line starts in
+    data = []
+    with open(path, "rb") as f:
+        if start == 0:
+            after_blank = True
+        else:
+            # Whether the line before the first full line of the chunk is blank, from the bytes before it
+            f.seek(max(start - 256, 0))
+            before = f.read(start - f.tell())
+            if before.endswith(b"\n"):
+                previous = before[:-1]
+                after_blank = is_blank(previous[previous.rfind(b"\n") + 1:])
+            else:
+                # The chunk begins inside a line that belongs to the chunk before
+                after_blank = is_blank(before[before.rfind(b"\n") + 1:] + f.readline())
+        position = f.tell()
+        inside = start == 0
+        for line in iter(f.readline, b""):
+            if after_blank and line.startswith(b"["):
+                if position >= end:
+                    break
+                inside = True
+            if inside:
+                data.append(line)
+            after_blank = is_blank(line)
+            position += len(line)
+    return b"".join(data).decode("utf-8", errors="replace")
+
+
+def line_name(headers):
+    opening = headers.get("Opening")
+    if opening:
+        variation = headers.get("Variation")
+        return f"{opening}: {variation}" if variation else opening
+    if headers.get("ECO"):
+        return headers["ECO"]
+    return f"{headers.get('White', '?')} - {headers.get('Black', '?')}"
+
+
+def opening_group(headers, path):
+    return headers.get("Opening") or headers.get("ECO") or os.path.splitext(os.path.basename(path))[0]
+
+
+def walk_lines(game, max_plies, variations):
+    # Every path from the root to a leaf, cut off after max_plies, main line first
+    stack = [(game, [])]
+    while stack:
+        node, moves = stack.pop()
+        children = node.variations if variations else node.variations[:1]
+        if len(moves) >= max_plies or not children:
+            if moves:
+                yield moves
+            continue
+        for child in reversed(children):
+            stack.append((child, moves + [child.move.uci()]))
+
+
+def import_chunk(task):
+    path, start, end, max_plies, variations = task
+    handle = io.StringIO(read_chunk(path, start, end))
+    lines = []
+    while True:
+        game = chess.pgn.read_game(handle)
+        if game is None:
+            break
+        if game.headers.get("SetUp") == "1" or "FEN" in game.headers:
+            continue  # Only lines from the starting position can be trained
+        name = line_name(game.headers)
+        group = opening_group(game.headers, path)
+        for moves in walk_lines(game, max_plies, variations):
+            lines.append((group, name, moves))
+    return lines
+
+
+def line_key(moves):
+    # 8 bytes per line are enough to find duplicates without keeping the lines around
+    return hashlib.blake2b(" ".join(moves).encode("ascii"), digest_size=8).digest()
+
+
+class SeenLines:
+    # Line keys and name counts of everything written so far, kept on disk instead of in memory
+
+    def __init__(self, path):
+        self.path = path
+        if os.path.exists(path):
+            os.remove(path)
+        self.db = sqlite3.connect(path)
+        self.db.execute("PRAGMA journal_mode = OFF")
+        self.db.execute("PRAGMA synchronous = OFF")
+        self.db.execute("CREATE TABLE lines (key BLOB PRIMARY KEY) WITHOUT ROWID")
+        self.db.execute("CREATE TABLE names (name TEXT PRIMARY KEY, count INTEGER) WITHOUT ROWID")
+
+    def add_line(self, moves):
+        # False when the same moves were seen before
+        return self.db.execute("INSERT OR IGNORE INTO lines VALUES (?)", (line_key(moves),)).rowcount == 1
+
+    def count_name(self, name):
+        # How often the name was used, including this time
+        row = self.db.execute("SELECT count FROM names WHERE name = ?", (name,)).fetchone()
+        count = row[0] + 1 if row else 1
+        self.db.execute("INSERT OR REPLACE INTO names VALUES (?, ?)", (name, count))
+        return count
+
+    def commit(self):
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
+        os.remove(self.path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Import opening lines from PGN files.")
+    parser.add_argument("pgn", nargs="+", help="PGN files to import")
+    parser.add_argument("-o", "--output", default=REPERTOIRE_PATH, help="repertoire file to write")
+    parser.add_argument("--max-plies", type=int, default=16, help="cut every line after this many plies")
+    parser.add_argument("--mainline-only", action="store_true", help="ignore variations inside the games")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count(), help="worker processes")
+    parser.add_argument("--chunk-mb", type=int, default=CHUNK_SIZE // (1024 * 1024), help="size of the pieces files are split into")
+    args = parser.parse_args(argv)
+
+    tasks = (
+        (path, start, end, args.max_plies, not args.mainline_only)
+        for path, start, end in find_chunks(args.pgn, args.chunk_mb * 1024 * 1024)
+    )
+
+    seen = SeenLines(args.output + ".seen")
+    written = 0
+    duplicates = 0
+    temporary_path = args.output + ".tmp"
+    try:
+        with open(temporary_path, "w", encoding="utf-8") as output, multiprocessing.Pool(args.jobs) as pool:
+            for lines in pool.imap(import_chunk, tasks):
+                for group, name, moves in lines:
+                    if not seen.add_line(moves):
+                        duplicates += 1
+                        continue
+
+                    # Several lines from the same opening get numbered names
+                    count = seen.count_name(name)
+                    if count > 1:
+                        name = f"{name} ({count})"
+
+                    output.write(json.dumps({"opening": group, "name": name, "moves": moves}) + "\n")
+                    written += 1
+                seen.commit()
+    finally:
+        seen.close()
+    os.replace(temporary_path, args.output)
+
+    print(f"Wrote {written} lines to {args.output}, skipped {duplicates} duplicates")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
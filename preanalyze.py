@@ -0,0 +1,117 @@
+import os
+import sys
+import time
+import argparse
+import concurrent.futures
+import chess
+import chess.polyglot
+from engine_pool import EnginePool
+from eval_cache import EvalCache
+
+# Evaluates every position of the repertoire ahead of time:
+#   python preanalyze.py --depth 18
+# The table is saved every few seconds, running the job again continues where it stopped.
+
+SAVE_INTERVAL = 10.0  # Seconds between saves of the table
+PROGRESS_INTERVAL = 2.0  # Seconds between progress lines
+
+
+def repertoire_positions(openings):
+    # Every position reached by any line, each one only once
+    seen = set()
+    for lines in openings.values():
+        for line in lines:
+            board = chess.Board()
+            for uci_move in line["moves"] + [None]:
+                key = chess.polyglot.zobrist_hash(board)
+                if key not in seen:
+                    seen.add(key)
+                    yield key, board.fen()
+                if uci_move is None:
+                    break
+                try:
+                    board.push_uci(uci_move)
+                except ValueError:
+                    print(f"Illegal move {uci_move} in {line['name']}, the rest of the line is skipped")
+                    break
+
+
+def main(argv=None):
+    from openings import openings
+    from config import STOCKFISH_PATH, PRECOMPUTED_EVAL_PATH, REPERTOIRE_CACHE_PATH
+    from repertoire_cache import load_repertoire_cache
+
+    parser = argparse.ArgumentParser(description="Evaluate every repertoire position with a pool of engines.")
+    parser.add_argument("--engine", default=STOCKFISH_PATH, help="path to the UCI engine")
+    parser.add_argument("--depth", type=int, default=18, help="search depth per position")
+    parser.add_argument("--nodes", type=int, help="node budget per position instead of a depth")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count(), help="engine processes")
+    parser.add_argument("--hash", type=int, default=64, help="hash table size per engine in MB")
+    parser.add_argument("-o", "--output", default=PRECOMPUTED_EVAL_PATH, help="evaluation table to write")
+    args = parser.parse_args(argv)
+
+    limit = {"nodes": args.nodes} if args.nodes else {"depth": args.depth}
+    min_depth = 0 if args.nodes else args.depth
+
+    # Unlimited size, the table is written exactly as computed
+    table = EvalCache(max_entries=sys.maxsize, path=args.output)
+    resumed = table.load()
+
+    # validate_repertoire.py already knows every position, the lines are only replayed without it
+    cache = load_repertoire_cache(REPERTOIRE_CACHE_PATH, openings)
+    positions = list(cache.positions.items()) if cache is not None else list(repertoire_positions(openings))
+    pending = [(key, fen) for key, fen in positions if table.entries.get(key, (-1,))[0] < min_depth]
+    print(f"{len(positions)} unique positions, {len(positions) - len(pending)} already done ({resumed} loaded), {len(pending)} to analyse")
+    if not pending:
+        return 0
+
+    pool = EnginePool([args.engine], size=args.jobs, options={"Hash": args.hash, "Threads": 1})
+    started = time.monotonic()
+    last_save = last_progress = started
+    done = 0
+    in_flight = {}
+    queue = iter(pending)
+
+    try:
+        while True:
+            # Keep every engine busy without queueing all positions at once
+            while len(in_flight) < args.jobs * 2:
+                item = next(queue, None)
+                if item is None:
+                    break
+                board = chess.Board(item[1])
+                in_flight[pool.analyse(board, limit)] = board
+            if not in_flight:
+                break
+
+            finished, _ = concurrent.futures.wait(in_flight, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in finished:
+                board = in_flight.pop(future)
+                try:
+                    info = future.result()
+                except Exception as e:
+                    print(f"Error while analysing {board.fen()}: {e}")
+                    continue
+                table.put(board, info["score"].white(), info.get("depth", 0))
+                done += 1
+
+            now = time.monotonic()
+            if now - last_progress >= PROGRESS_INTERVAL:
+                print(f"{done}/{len(pending)} positions, {done / (now - started):.1f} positions/s")
+                last_progress = now
+            if now - last_save >= SAVE_INTERVAL:
+                table.save()
+                last_save = now
+    except KeyboardInterrupt:
+        print("Interrupted, saving what was analysed so far")
+    finally:
+        table.save()
+        pool.close()
+
+    elapsed = time.monotonic() - started
+    print(f"Analysed {done} positions in {elapsed:.1f}s ({done / max(elapsed, 1e-9):.1f} positions/s), table written to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
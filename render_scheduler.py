@@ -0,0 +1,54 @@
+import time
+import pygame
+
+
+class RenderScheduler:
+    # Collects the screen regions that changed and only pushes those to the display
+
+    def __init__(self, max_fps=60):
+        self.max_fps = max_fps
+        self.clock = pygame.time.Clock()
+        self.dirty_rects = []
+        self.full_redraw = True  # The first frame always draws the whole window
+        self.update_time = 0.0  # Seconds the last present() spent pushing pixels, without the frame cap
+
+    def mark(self, rect):
+        if rect is not None:
+            self.dirty_rects.append(pygame.Rect(rect))
+
+    def mark_all(self):
+        self.full_redraw = True
+
+    def is_idle(self):
+        return not self.full_redraw and not self.dirty_rects
+
+    def clip_rect(self, screen):
+        # Area that draw calls need to cover for the next frame
+        if self.full_redraw or not self.dirty_rects:
+            return screen.get_rect()
+        return self.dirty_rects[0].unionall(self.dirty_rects[1:]).clip(screen.get_rect())
+
+    def get_events(self, timeout=None):
+        # Sleep inside SDL until something happens when there is nothing left to draw,
+        # at most timeout seconds when the caller has something scheduled
+        if self.is_idle():
+            if timeout is None:
+                first = pygame.event.wait()
+            else:
+                first = pygame.event.wait(max(int(timeout * 1000), 1))
+            return [first] + pygame.event.get()
+        return pygame.event.get()
+
+    def present(self):
+        started = time.perf_counter()
+        if self.full_redraw:
+            pygame.display.flip()
+        elif self.dirty_rects:
+            pygame.display.update(self.dirty_rects)
+        self.update_time = time.perf_counter() - started
+        self.full_redraw = False
+        self.dirty_rects = []
+
+        # Cap the frame rate while frames are being produced
+        if self.max_fps:
+            self.clock.tick(self.max_fps)
@@ -0,0 +1,88 @@
+import os
+import json
+import struct
+import hashlib
+from array import array
+from opening_index import OpeningIndex, LineRecord
+
+# Replayed repertoire written by validate_repertoire.py: the move codes of every line, the
+# zobrist key of the position before every ply and the FEN of every distinct position.
+# The trainer and preanalyze.py read it instead of replaying the lines with python-chess.
+# The fingerprint of the lines it was built from is stored, a changed repertoire ignores the cache.
+
+CACHE_MAGIC = b"PCREPC01"
+HEADER = struct.Struct("<20sIIII")  # fingerprint, lines, plies, positions, metadata bytes
+FEN_HEADER = struct.Struct("<I")
+
+
+def repertoire_fingerprint(openings):
+    digest = hashlib.sha1()
+    for opening_name, lines in openings.items():
+        for line in lines:
+            digest.update(json.dumps([opening_name, line["name"], line["moves"]]).encode("utf-8"))
+    return digest.digest()
+
+
+class RepertoireCache:
+    def __init__(self, fingerprint, lines, offsets, moves, keys, positions):
+        self.fingerprint = fingerprint
+        self.lines = lines  # LineRecords
+        self.offsets = offsets  # array('I'), the plies of line i are offsets[i]:offsets[i + 1]
+        self.moves = moves  # array('H') of move codes
+        self.keys = keys  # array('Q'), zobrist key of the position before each move
+        self.positions = positions  # zobrist key -> FEN
+
+    def write(self, path):
+        metadata = json.dumps([[line.opening, line.name, line.plies] for line in self.lines]).encode("utf-8")
+        position_keys = array("Q", self.positions)
+        fens = "\n".join(self.positions[key] for key in position_keys).encode("ascii")
+
+        temporary_path = path + ".tmp"
+        with open(temporary_path, "wb") as f:
+            f.write(CACHE_MAGIC)
+            f.write(HEADER.pack(self.fingerprint, len(self.lines), len(self.moves), len(position_keys), len(metadata)))
+            f.write(self.offsets.tobytes())
+            f.write(self.moves.tobytes())
+            f.write(self.keys.tobytes())
+            f.write(metadata)
+            f.write(position_keys.tobytes())
+            f.write(FEN_HEADER.pack(len(fens)))
+            f.write(fens)
+        os.replace(temporary_path, path)
+
+    def build_index(self):
+        # Same result as build_opening_index(), without a single move being replayed
+        index = OpeningIndex()
+        index.lines = self.lines
+        index.offsets = self.offsets
+        index.moves = self.moves
+        index.keys = self.keys
+        index.finish()
+        return index
+
+def read_array(f, typecode, count):
+    values = array(typecode)
+    values.frombytes(f.read(values.itemsize * count))
+    return values
+
+
+def load_repertoire_cache(path, openings=None):
+    # None when there is no cache or it was built from other lines than openings
+    if path is None or not os.path.exists(path):
+        return None
+    with open(path, "rb") as f:
+        if f.read(len(CACHE_MAGIC)) != CACHE_MAGIC:
+            print(f"Ignoring {path}, it is not a repertoire cache")
+            return None
+        fingerprint, line_count, ply_count, position_count, metadata_size = HEADER.unpack(f.read(HEADER.size))
+        if openings is not None and fingerprint != repertoire_fingerprint(openings):
+            print(f"Ignoring {path}, the repertoire changed since it was written")
+            return None
+
+        offsets = read_array(f, "I", line_count + 1)
+        moves = read_array(f, "H", ply_count)
+        keys = read_array(f, "Q", ply_count)
+        lines = [LineRecord(*line) for line in json.loads(f.read(metadata_size))]
+        position_keys = read_array(f, "Q", position_count)
+        fens = f.read(FEN_HEADER.unpack(f.read(FEN_HEADER.size))[0]).decode("ascii").split("\n")
+    return RepertoireCache(fingerprint, lines, offsets, moves, keys, dict(zip(position_keys, fens)))
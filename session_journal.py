@@ -0,0 +1,185 @@
+import os
+import sys
+import mmap
+import time
+import queue
+import struct
+import threading
+from collections import Counter
+from move_encoding import decode_uci
+
+# Append-only log of everything that happens in a training session. Every record is 24 bytes:
+# time, event kind, flags, ply, move, second move, value and line id. Records are collected in
+# memory and written in batches by a background thread, so the pygame loop never waits for the disk.
+#   python session_journal.py [session_journal.bin]
+# prints a summary of a journal.
+
+FILE_MAGIC = b"PCJRNL01"
+RECORD = struct.Struct("<dBBHHHiI")
+
+SESSION_START = 1  # line: line id
+PLAYER_MOVE = 2  # move: trainee's move, value: think time in ms, flags: 1 for a book move
+WRONG_MOVE = 3  # move: trainee's move, other: expected move, flags: number of book moves
+BOOK_REPLY = 4  # move: Black's book move
+ENGINE_REPLY = 5  # move: Black's engine move, value: ms since the request, flags: 1 if pondered
+EVALUATION = 6  # value: score from White's point of view, flags: score kind of eval_cache.py, other: depth
+ENGINE_LATENCY = 7  # value: ms from the request to the final result, other: depth
+RENDER = 8  # value: time to draw a frame in microseconds
+
+KIND_NAMES = {
+    SESSION_START: "session start",
+    PLAYER_MOVE: "player move",
+    WRONG_MOVE: "wrong move",
+    BOOK_REPLY: "book reply",
+    ENGINE_REPLY: "engine reply",
+    EVALUATION: "evaluation",
+    ENGINE_LATENCY: "engine latency",
+    RENDER: "render",
+}
+
+
+class SessionJournal:
+    def __init__(self, path, batch_records=512, flush_interval=2.0):
+        self.path = path
+        self.batch_records = batch_records
+        self.flush_interval = flush_interval  # Seconds a record waits at most before it is written
+        self.buffer = bytearray()
+        self.buffered = 0
+        self.last_flush = time.monotonic()
+        self.batches = queue.Queue()
+        self.failed = False  # Set by the writer thread when the file cannot be written, recording stops
+        self.thread = threading.Thread(target=self.write_batches, name="session-journal", daemon=True)
+        self.thread.start()
+
+    def record(self, kind, ply=0, move=0, other=0, value=0, line=0, flags=0):
+        if self.failed:
+            return
+        self.buffer += RECORD.pack(time.time(), kind, flags, ply, move, other, value, line)
+        self.buffered += 1
+        if self.buffered >= self.batch_records or time.monotonic() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        # Hands the buffered records to the writer thread
+        if self.failed:
+            self.buffer.clear()
+            self.buffered = 0
+        elif self.buffer:
+            self.batches.put(bytes(self.buffer))
+            self.buffer.clear()
+            self.buffered = 0
+        self.last_flush = time.monotonic()
+
+    def write_batches(self):
+        f = None
+        try:
+            while True:
+                batch = self.batches.get()
+                if batch is None:
+                    break
+                if f is None:
+                    directory = os.path.dirname(self.path)
+                    if directory:
+                        os.makedirs(directory, exist_ok=True)
+                    f = open(self.path, "ab")
+                    size = f.tell()
+                    if size < len(FILE_MAGIC):
+                        f.truncate(0)
+                        f.write(FILE_MAGIC)
+                    else:
+                        # A record cut off by a crash is dropped, new records start on a record boundary
+                        usable = len(FILE_MAGIC) + (size - len(FILE_MAGIC)) // RECORD.size * RECORD.size
+                        if usable != size:
+                            f.truncate(usable)
+                f.write(batch)
+                f.flush()
+        except OSError as e:
+            self.failed = True
+            print(f"Could not write session journal {self.path}, recording stopped: {e}")
+        finally:
+            if f is not None:
+                f.close()
+
+    def close(self):
+        self.flush()
+        self.batches.put(None)
+        self.thread.join(5.0)
+
+
+class JournalReader:
+    # Reads a journal through a memory map, records are unpacked only while iterating
+
+    def __init__(self, path):
+        self.file = open(path, "rb")
+        self.view = None
+        size = os.fstat(self.file.fileno()).st_size
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+        if self.data[:len(FILE_MAGIC)] != FILE_MAGIC:
+            self.close()
+            raise ValueError(f"{path} is not a session journal")
+
+        # A record cut off by a crash at the end of the file is ignored
+        usable = (size - len(FILE_MAGIC)) // RECORD.size * RECORD.size
+        self.view = memoryview(self.data)[len(FILE_MAGIC):len(FILE_MAGIC) + usable]
+
+    def __len__(self):
+        return len(self.view) // RECORD.size
+
+    def __iter__(self):
+        return RECORD.iter_unpack(self.view)
+
+    def scan(self, *kinds):
+        # (time, kind, flags, ply, move, other, value, line) of the given kinds, or of all records
+        if not kinds:
+            return iter(self)
+        return (record for record in RECORD.iter_unpack(self.view) if record[1] in kinds)
+
+    def close(self):
+        if self.view is not None:
+            self.view.release()
+            self.view = None
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+        self.file.close()
+
+
+def summarize(path):
+    reader = JournalReader(path)
+    counts = Counter()
+    book_moves = 0
+    think_times = []
+    render_times = []
+    engine_times = []
+    missed = Counter()
+    for record in reader:
+        kind = record[1]
+        counts[kind] += 1
+        if kind == PLAYER_MOVE:
+            think_times.append(record[6])
+            book_moves += record[2] & 1
+        elif kind == RENDER:
+            render_times.append(record[6])
+        elif kind == ENGINE_LATENCY:
+            engine_times.append(record[6])
+        elif kind == WRONG_MOVE and record[5]:
+            missed[record[5]] += 1
+    reader.close()
+
+    print(f"{sum(counts.values())} records in {path}")
+    for kind, count in sorted(counts.items()):
+        print(f"  {KIND_NAMES.get(kind, kind)}: {count}")
+    if think_times:
+        print(f"Average think time: {sum(think_times) / len(think_times) / 1000.0:.1f}s")
+    if book_moves or counts[WRONG_MOVE]:
+        print(f"Book accuracy: {100.0 * book_moves / (book_moves + counts[WRONG_MOVE]):.1f}%")
+    if render_times:
+        print(f"Average frame: {sum(render_times) / len(render_times) / 1000.0:.2f}ms")
+    if engine_times:
+        print(f"Average engine latency: {sum(engine_times) / len(engine_times):.0f}ms")
+    for code, count in missed.most_common(5):
+        print(f"  missed {decode_uci(code)} {count} times")
+
+
+if __name__ == "__main__":
+    from config import JOURNAL_PATH
+    summarize(sys.argv[1] if len(sys.argv) > 1 else JOURNAL_PATH)
@@ -0,0 +1,101 @@
+import random
+import unittest
+import chess
+from opening_index import build_opening_index
+from move_encoding import encode_move
+from trainer_session import TrainerSession, simulate_drill, NOT_IN_BOOK, NOT_YOUR_TURN, ILLEGAL
+
+# Runs without pygame or an engine:
+#   python -m unittest test_trainer_session
+
+OPENINGS = {
+    "Open Game": [
+        {"name": "Spanish", "moves": ["e2e4", "e7e5", "g1f3", "b8c6", "f1b5"]},
+        {"name": "Bishop's Opening", "moves": ["e2e4", "e7e5", "f1c4", "g8f6", "d2d3"]},
+    ],
+    "Queen's Gambit": [
+        {"name": "Queen's Pawn", "moves": ["d2d4", "g8f6", "c2c4", "e7e6", "b1c3"]},
+        {"name": "English", "moves": ["c2c4", "e7e6", "d2d4", "g8f6", "g1f3"]},
+    ],
+}
+
+
+class FirstMoveEngine:
+    # Plays the first legal move in UCI order
+
+    def best_move(self, board):
+        return min(move.uci() for move in board.legal_moves)
+
+    def evaluate(self, board):
+        return None
+
+
+class TrainerSessionTest(unittest.TestCase):
+    def setUp(self):
+        self.book = build_opening_index(OPENINGS)
+
+    def session(self, opening_name, line_name, engine=None):
+        line_id = next(line_id for line_id, line in enumerate(self.book.lines) if line.name == line_name)
+        return TrainerSession(self.book, opening_name, line_id, engine, random.Random(0))
+
+    def test_drill_plays_the_line_and_hands_over_to_the_engine(self):
+        session = self.session("Open Game", "Spanish", FirstMoveEngine())
+        self.assertEqual(simulate_drill(session, max_plies=10), 10)
+        self.assertEqual([move.uci() for move in session.board.move_stack[:5]], OPENINGS["Open Game"][0]["moves"])
+        self.assertEqual(list(session.history), [encode_move(move) for move in session.board.move_stack])
+        self.assertEqual(session.line_name, "Spanish")
+        self.assertEqual(session.remaining_moves, 0)
+
+    def test_book_move_of_another_line_switches_lines(self):
+        session = self.session("Open Game", "Spanish")
+        self.assertEqual(session.play_move("e2e4").book_reply, "e7e5")
+
+        result = session.play_move("f1c4")
+        self.assertTrue(result.accepted)
+        self.assertTrue(result.switched_line)
+        self.assertEqual(session.line_name, "Bishop's Opening")
+        self.assertEqual(result.book_reply, "g8f6")
+        self.assertEqual(session.remaining_moves, 1)
+
+    def test_transposition_continues_with_the_other_line(self):
+        session = self.session("Queen's Gambit", "English")
+        session.play_move("c2c4")
+        session.play_move("d2d4")
+        self.assertEqual(session.board.board_fen(), "rnbqkb1r/pppp1ppp/4pn2/8/2PP4/8/PP2PPPP/RNBQKBNR")
+
+        # 1.d4 Nf6 2.c4 e6 reaches the same position, its next move is a book move here too
+        result = session.play_move("b1c3")
+        self.assertTrue(result.accepted)
+        self.assertTrue(result.switched_line)
+        self.assertEqual(session.line_name, "Queen's Pawn")
+        self.assertTrue(result.opening_completed)
+        self.assertTrue(result.engine_to_move)
+
+    def test_rejected_moves_leave_the_board_unchanged(self):
+        session = self.session("Open Game", "Spanish")
+
+        result = session.play_move("d2d4")
+        self.assertFalse(result.accepted)
+        self.assertEqual(result.reason, NOT_IN_BOOK)
+        self.assertEqual(result.expected_moves, ["e2e4"])
+        self.assertEqual(session.board.ply(), 0)
+
+        # Lines of other openings are not part of the session's book
+        self.assertEqual(session.play_move("c2c4").reason, NOT_IN_BOOK)
+
+        session.board.push(chess.Move.from_uci("e2e4"))
+        self.assertEqual(session.play_move("e7e5").reason, NOT_YOUR_TURN)
+
+    def test_illegal_move_after_the_book(self):
+        session = self.session("Open Game", "Bishop's Opening")
+        for uci_move in ["e2e4", "f1c4", "d2d3"]:
+            session.play_move(uci_move)
+        session.apply_engine_move("b8c6")
+
+        result = session.play_move("c4c6")
+        self.assertEqual(result.reason, ILLEGAL)
+        self.assertTrue(session.play_move("c4b5").accepted)
+
+
+if __name__ == "__main__":
+    unittest.main()
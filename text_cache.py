@@ -0,0 +1,87 @@
+from collections import OrderedDict
+import pygame
+
+# Fonts and rendered strings are reused between frames, text is only rasterized
+# again when the string, font or colour changes. Shared by main.py and opening_selector.py.
+
+
+class TextCache:
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self.fonts = {}  # (font name, size) -> pygame.font.Font
+        self.surfaces = OrderedDict()  # (font name, size, text, colour, antialias) -> Surface
+        self.fitted = {}  # (font name, size, text, width) -> text shortened to fit the width
+        self.hits = 0
+        self.misses = 0
+
+    def font(self, size, name=None):
+        key = (name, size)
+        font = self.fonts.get(key)
+        if font is None:
+            font = pygame.font.Font(name, size)
+            self.fonts[key] = font
+        return font
+
+    def render(self, text, size, color, name=None, antialias=True):
+        key = (name, size, text, tuple(color), antialias)
+        surface = self.surfaces.get(key)
+        if surface is not None:
+            self.surfaces.move_to_end(key)
+            self.hits += 1
+            return surface
+
+        self.misses += 1
+        surface = self.font(size, name).render(text, antialias, color)
+        self.surfaces[key] = surface
+        # Strings that are no longer shown, e.g. an old move counter, drop out first
+        while len(self.surfaces) > self.max_entries:
+            self.surfaces.popitem(last=False)
+        return surface
+
+    def fit(self, text, size, width, name=None):
+        # The longest start of text that fits into width pixels, with "..." when it was cut
+        key = (name, size, text, width)
+        fitted = self.fitted.get(key)
+        if fitted is not None:
+            return fitted
+
+        font = self.font(size, name)
+        fitted = text
+        if font.size(text)[0] > width:
+            low, high = 0, len(text)
+            while low < high:
+                middle = (low + high + 1) // 2
+                if font.size(text[:middle] + "...")[0] <= width:
+                    low = middle
+                else:
+                    high = middle - 1
+            fitted = text[:low] + "..."
+
+        if len(self.fitted) >= self.max_entries:
+            self.fitted.clear()
+        self.fitted[key] = fitted
+        return fitted
+
+    def fits(self, text, size, width, name=None):
+        # Whether text fits into width pixels as it is, answered from the fit() cache after the first frame
+        return self.fit(text, size, width, name) == text
+
+    def clear(self):
+        self.fonts.clear()
+        self.surfaces.clear()
+        self.fitted.clear()
+
+
+text_cache = TextCache()
+
+
+def render_text(text, size, color, name=None):
+    return text_cache.render(text, size, color, name)
+
+
+def fit_text(text, size, width, name=None):
+    return text_cache.fit(text, size, width, name)
+
+
+def text_fits(text, size, width, name=None):
+    return text_cache.fits(text, size, width, name)
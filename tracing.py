@@ -0,0 +1,189 @@
+import os
+import json
+import time
+import inspect
+import functools
+import itertools
+import threading
+from array import array
+
+# Spans of the hot paths, recorded into a preallocated ring buffer and written as Chrome
+# trace-event JSON that chrome://tracing and ui.perfetto.dev open:
+#   with tracer.span("draw_board", "render"): ...
+#   @traced("engine")
+# While tracing is disabled a span costs one attribute check, so the hooks stay in the code.
+# The buffer keeps the newest events, i.e. the seconds before a freeze when it is written.
+
+
+class NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+NULL_SPAN = NullSpan()
+
+
+class Span:
+    __slots__ = ("tracer", "name", "category", "track", "started")
+
+    def __init__(self, tracer, name, category, track):
+        self.tracer = tracer
+        self.name = name
+        self.category = category
+        self.track = track
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.tracer.complete(self.name, self.category, self.started, time.perf_counter() - self.started, self.track)
+        return False
+
+
+class Tracer:
+    def __init__(self, capacity=65536, enabled=False):
+        self.enabled = enabled
+        self.lock = threading.Lock()  # Only taken for names and threads seen for the first time
+        self.names = {}  # (name, category) -> index into labels
+        self.labels = []
+        self.thread_names = {}  # tid -> name shown for the row
+        self.tracks = {}  # track name -> tid of a row that is not a thread, e.g. one engine process
+        self.origin = time.perf_counter()
+        self.allocate(capacity)
+
+    def allocate(self, capacity):
+        self.capacity = capacity
+        self.starts = array("d", [0.0]) * capacity
+        self.durations = array("d", [0.0]) * capacity  # Negative for instant events
+        self.labels_used = array("I", [0]) * capacity
+        self.threads = array("Q", [0]) * capacity
+        self.slots = itertools.count()  # next() is atomic, threads never get the same slot
+        self.end = 0
+
+    def start(self, capacity=None):
+        if capacity is not None and capacity != self.capacity:
+            self.allocate(capacity)
+        self.enabled = True
+
+    def stop(self):
+        self.enabled = False
+
+    def label(self, name, category):
+        key = (name, category)
+        index = self.names.get(key)
+        if index is None:
+            with self.lock:
+                index = self.names.get(key)
+                if index is None:
+                    index = len(self.labels)
+                    self.labels.append(key)
+                    self.names[key] = index
+        return index
+
+    def thread(self, track):
+        if track is not None:
+            tid = self.tracks.get(track)
+            if tid is None:
+                with self.lock:
+                    tid = self.tracks.setdefault(track, len(self.tracks) + 1)
+                    self.thread_names[tid] = track
+            return tid
+        tid = threading.get_ident()
+        if tid not in self.thread_names:
+            self.thread_names[tid] = threading.current_thread().name
+        return tid
+
+    def complete(self, name, category, started, duration, track=None):
+        # A span that ran from started (time.perf_counter()) for duration seconds
+        if not self.enabled:
+            return
+        slot = next(self.slots)
+        index = slot % self.capacity
+        self.starts[index] = started
+        self.durations[index] = duration
+        self.labels_used[index] = self.label(name, category)
+        self.threads[index] = self.thread(track)
+        self.end = slot + 1
+
+    def instant(self, name, category, track=None):
+        self.complete(name, category, time.perf_counter(), -1.0, track)
+
+    def span(self, name, category, track=None):
+        if not self.enabled:
+            return NULL_SPAN
+        return Span(self, name, category, track)
+
+    def events(self):
+        # Trace events of the buffer, oldest first
+        pid = os.getpid()
+        events = [{"name": "process_name", "ph": "M", "pid": pid, "tid": 0, "args": {"name": "pythonchess"}}]
+        for tid, thread_name in list(self.thread_names.items()):
+            events.append({"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": thread_name}})
+
+        end = self.end
+        for slot in range(max(end - self.capacity, 0), end):
+            index = slot % self.capacity
+            name, category = self.labels[self.labels_used[index]]
+            event = {
+                "name": name,
+                "cat": category,
+                "ts": (self.starts[index] - self.origin) * 1000000.0,
+                "pid": pid,
+                "tid": self.threads[index],
+            }
+            duration = self.durations[index]
+            if duration < 0:
+                event["ph"] = "i"
+                event["s"] = "t"
+            else:
+                event["ph"] = "X"
+                event["dur"] = duration * 1000000.0
+            events.append(event)
+        return events
+
+    def dump(self, path):
+        # Returns the number of events written
+        events = self.events()
+        temporary_path = path + ".tmp"
+        with open(temporary_path, "w", encoding="utf-8") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+        os.replace(temporary_path, path)
+        return min(self.end, self.capacity)
+
+
+tracer = Tracer()
+
+
+def traced(category, name=None):
+    # Decorator that records every call of a function or coroutine function as a span
+    def decorate(function):
+        label = name or function.__qualname__
+
+        if inspect.iscoroutinefunction(function):
+            @functools.wraps(function)
+            async def async_wrapper(*args, **kwargs):
+                if not tracer.enabled:
+                    return await function(*args, **kwargs)
+                started = time.perf_counter()
+                try:
+                    return await function(*args, **kwargs)
+                finally:
+                    tracer.complete(label, category, started, time.perf_counter() - started)
+            return async_wrapper
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not tracer.enabled:
+                return function(*args, **kwargs)
+            started = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                tracer.complete(label, category, started, time.perf_counter() - started)
+        return wrapper
+
+    return decorate
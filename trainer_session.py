@@ -0,0 +1,215 @@
+import random
+from array import array
+import chess
+from move_encoding import encode_move, decode_move, decode_uci
+
+# The rules of a training session without any pygame code, so drills can run
+# headless in batch jobs, tests and servers. The pygame window in main.py is a
+# client of this class.
+
+NOT_YOUR_TURN = "not_your_turn"
+NOT_IN_BOOK = "not_in_book"
+ILLEGAL = "illegal"
+
+
+class PositionSnapshot:
+    # Everything the UI and move handling need about the current position,
+    # computed with a single move generation each time a move is pushed
+
+    __slots__ = ("turn", "targets", "legal_moves", "status")
+
+    def __init__(self, board):
+        self.turn = board.turn
+        self.targets = {}  # from square -> set of target squares
+        self.legal_moves = set()  # move codes of move_encoding.py
+        for move in board.legal_moves:
+            self.targets.setdefault(move.from_square, set()).add(move.to_square)
+            self.legal_moves.add(encode_move(move))
+
+        if not self.legal_moves:
+            self.status = "Checkmate" if board.is_check() else "Stalemate"
+        elif board.is_check():
+            self.status = "Check"
+        else:
+            self.status = ""
+
+    def is_legal_target(self, from_square, to_square):
+        return to_square in self.targets.get(from_square, ())
+
+
+class MoveResult:
+    def __init__(self, uci_move):
+        self.uci_move = uci_move
+        self.accepted = False
+        self.reason = None  # NOT_YOUR_TURN, NOT_IN_BOOK or ILLEGAL when the move was rejected
+        self.expected_moves = []  # Book moves that would have been accepted
+        self.switched_line = False  # The move left the current line for another one
+        self.book_reply = None  # Black's answer from the book
+        self.opening_completed = False  # The book has no answer, the engine takes over
+        self.engine_to_move = False  # Black's reply has to come from the engine
+        self.engine_reply = None  # Filled in when the session has a synchronous engine
+        self.evaluation = None
+
+
+class TrainerSession:
+    # One game: the trainee plays White, Black answers from the book and then from the engine.
+    # engine is optional, any object with best_move(board) and evaluate(board) works,
+    # without one the caller asks its own engine and passes the reply to apply_engine_move().
+
+    def __init__(self, opening_book, opening_name, line_id=None, engine=None, rng=random):
+        self.board = chess.Board()
+        self.history = array("H")  # Move codes of the game, the journal records them without parsing UCI again
+        self.position_snapshot = None  # Built on first use, see snapshot
+        self.position_book_moves = None  # Book moves of the current position once looked up
+        self.opening_book = opening_book
+        self.opening_name = opening_name
+        self.engine = engine
+        self.rng = rng
+
+        # Every line of the selected opening counts, so any book move is accepted. The set belongs
+        # to the session, sessions on other openings can share the same book
+        self.active_lines = opening_book.opening_lines(opening_name)
+        if line_id is None:
+            line_id = rng.choice(sorted(self.active_lines))
+        self.current_line_id = line_id  # Changes when the trainee switches lines
+        self.opening_index = 0  # Index for the current move within the current line
+
+    @property
+    def line_name(self):
+        return self.opening_book.lines[self.current_line_id].name
+
+    @property
+    def remaining_moves(self):
+        return self.opening_book.lines[self.current_line_id].plies - self.opening_index
+
+    def continuations(self):
+        # Book moves of the selected opening in the current position, hashed and looked up once per position
+        if self.position_book_moves is None:
+            self.position_book_moves = self.opening_book.continuations(self.board, self.active_lines)
+        return self.position_book_moves
+
+    def current_line_move(self):
+        # (move code, ply) the current line plays here, None once it has no move here
+        for code, line_plies in self.continuations().items():
+            if self.current_line_id in line_plies:
+                return code, line_plies[self.current_line_id]
+        return None
+
+    @property
+    def snapshot(self):
+        # Computed once per position and only when asked for, so the trainee's move that the
+        # book answers right away costs no move generation
+        if self.position_snapshot is None:
+            self.position_snapshot = PositionSnapshot(self.board)
+        return self.position_snapshot
+
+    def has_legal_moves(self):
+        # Stops at the first legal move unless the snapshot already has them all
+        if self.position_snapshot is not None:
+            return bool(self.position_snapshot.legal_moves)
+        return any(self.board.generate_legal_moves())
+
+    def engine_to_move(self):
+        return self.board.turn == chess.BLACK and self.has_legal_moves()
+
+    def push(self, move):
+        # Every move goes through here so the snapshot always matches the board
+        self.board.push(move)
+        self.history.append(encode_move(move))
+        self.position_snapshot = None
+        self.position_book_moves = None
+
+    def play_book_reply(self):
+        # Answer from the current line, or from another line that continues from this position
+        book_moves = self.continuations()
+        if not book_moves:
+            return None
+
+        reply = self.current_line_move()
+        if reply is None:
+            code, line_plies = next(iter(book_moves.items()))
+            self.current_line_id = self.rng.choice(sorted(line_plies))
+            reply = (code, line_plies[self.current_line_id])
+
+        code, ply = reply
+        move = decode_move(code)
+        self.push(move)
+        self.opening_index = ply + 1
+        return move.uci()
+
+    def play_move(self, uci_move):
+        # The trainee's move, returns what happened as a MoveResult
+        result = MoveResult(uci_move)
+
+        if self.board.turn != chess.WHITE:
+            result.reason = NOT_YOUR_TURN
+            return result
+
+        # The trainee's move is converted once, everything below compares move codes
+        move = chess.Move.from_uci(uci_move)
+        book_moves = self.continuations()
+        if book_moves:
+            code = encode_move(move)
+            if code not in book_moves:
+                result.reason = NOT_IN_BOOK
+                result.expected_moves = [decode_uci(book_code) for book_code in book_moves]
+                return result
+
+            # Any book move is fine, stay on the current line if it allows the move
+            line_plies = book_moves[code]
+            if self.current_line_id not in line_plies:
+                self.current_line_id = self.rng.choice(sorted(line_plies))
+                result.switched_line = True
+
+            self.push(decode_move(code))
+            self.opening_index = line_plies[self.current_line_id] + 1
+            result.book_reply = self.play_book_reply()
+            result.opening_completed = result.book_reply is None
+        else:
+            if move.promotion is None and self.board.piece_type_at(move.from_square) == chess.PAWN and chess.square_rank(move.to_square) in [0, 7]:
+                move.promotion = chess.QUEEN  # Promote to queen by default
+            if encode_move(move) not in self.snapshot.legal_moves:
+                result.reason = ILLEGAL
+                return result
+            self.push(move)
+
+        result.accepted = True
+        result.engine_to_move = self.engine_to_move()
+
+        if self.engine is not None:
+            if result.engine_to_move:
+                result.engine_reply = self.engine.best_move(self.board)
+                if result.engine_reply is not None:
+                    self.apply_engine_move(result.engine_reply)
+            result.evaluation = self.engine.evaluate(self.board)
+        return result
+
+    def apply_engine_move(self, uci_move):
+        # Black's reply from the engine, False if it cannot be played here
+        if not uci_move or self.board.turn != chess.BLACK:
+            return False
+        move = chess.Move.from_uci(uci_move)
+        if encode_move(move) not in self.snapshot.legal_moves:
+            return False
+        self.push(move)
+        return True
+
+
+def simulate_drill(session, max_plies=400):
+    # Plays the current line as the trainee until the book ends, then the first legal
+    # move against the session's engine, returns the number of plies played
+    while session.board.ply() < max_plies and session.has_legal_moves():
+        book_move = session.current_line_move()
+        if book_move is not None:
+            uci_move = decode_uci(book_move[0])
+        elif session.continuations():
+            uci_move = decode_uci(next(iter(session.continuations())))
+        elif session.engine is not None:
+            uci_move = decode_uci(min(session.snapshot.legal_moves))
+        else:
+            break
+
+        result = session.play_move(uci_move)
+        if not result.accepted or (result.engine_to_move and result.engine_reply is None):
+            break
+    return session.board.ply()
@@ -0,0 +1,150 @@
+import os
+import sys
+import argparse
+import multiprocessing
+from array import array
+import chess
+import chess.polyglot
+from move_encoding import encode_move
+from opening_index import LineRecord
+from repertoire_cache import RepertoireCache, repertoire_fingerprint
+
+# Checks every line of the repertoire before it is trained and writes the replayed positions:
+#   python validate_repertoire.py --jobs 8
+# Illegal moves are reported with the line name and ply, duplicate lines and lines that are
+# a prefix of another line are flagged. The exit code is 1 when a line has an illegal move.
+
+CHUNK_LINES = 2000  # Lines per task of the process pool
+
+
+def replay_chunk(chunk):
+    # Lines arrive sorted by their moves, so a line usually starts with the moves of the one
+    # before it: the board is taken back to the shared prefix and only the rest is replayed
+    results = []
+    seen = set()
+    board = chess.Board()
+    previous_moves = []
+    previous_codes = []
+    previous_keys = []
+    for line_id, name, moves in chunk:
+        shared = 0
+        limit = min(len(moves), len(previous_codes))
+        while shared < limit and moves[shared] == previous_moves[shared]:
+            shared += 1
+        while len(board.move_stack) > shared:
+            board.pop()
+
+        codes = previous_codes[:shared]
+        keys = previous_keys[:shared]
+        new_positions = []
+        error = None
+        for ply in range(shared, len(moves)):
+            key = chess.polyglot.zobrist_hash(board)
+            if key not in seen:
+                seen.add(key)
+                new_positions.append((key, board.fen()))
+            try:
+                move = board.parse_uci(moves[ply])
+            except ValueError as e:
+                error = (ply, moves[ply], str(e).split(":")[0], board.fen())
+                break
+            codes.append(encode_move(move))
+            keys.append(key)
+            board.push(move)
+
+        # The position the line ends in is analysed too
+        if error is None:
+            key = chess.polyglot.zobrist_hash(board)
+            if key not in seen:
+                seen.add(key)
+                new_positions.append((key, board.fen()))
+
+        results.append((line_id, array("H", codes).tobytes(), array("Q", keys).tobytes(), new_positions, error))
+        previous_moves, previous_codes, previous_keys = moves, codes, keys
+    return results
+
+
+def find_redundant_lines(entries):
+    # Sorting the move lists puts equal lines next to each other and every
+    # prefix right before the lines that continue it
+    ordered = sorted(entries, key=lambda entry: entry[2])
+    duplicates = []
+    prefixes = []
+    for (_, name, moves), (_, next_name, next_moves) in zip(ordered, ordered[1:]):
+        if moves == next_moves:
+            duplicates.append((name, next_name))
+        elif next_moves[:len(moves)] == moves:
+            prefixes.append((name, next_name))
+    return duplicates, prefixes
+
+
+def validate(openings, jobs):
+    entries = []
+    lines = []
+    for opening_name, opening_lines in openings.items():
+        for line in opening_lines:
+            entries.append((len(lines), line["name"], line["moves"]))
+            lines.append(LineRecord(opening_name, line["name"], len(line["moves"])))
+
+    ordered = sorted(entries, key=lambda entry: entry[2])
+    chunks = [ordered[start:start + CHUNK_LINES] for start in range(0, len(ordered), CHUNK_LINES)]
+    replayed = [None] * len(lines)
+    positions = {}
+    errors = []
+
+    if jobs > 1 and len(chunks) > 1:
+        with multiprocessing.Pool(jobs) as pool:
+            chunk_results = list(pool.imap_unordered(replay_chunk, chunks))
+    else:
+        chunk_results = [replay_chunk(chunk) for chunk in chunks]
+
+    for results in chunk_results:
+        for line_id, codes, keys, new_positions, error in results:
+            replayed[line_id] = (codes, keys)
+            lines[line_id].plies = len(codes) // 2  # A line with an illegal move ends before it
+            for key, fen in new_positions:
+                positions.setdefault(key, fen)
+            if error is not None:
+                errors.append((line_id, error))
+
+    # Lines are stored in repertoire order, the cache is indexed by line id
+    offsets = array("I", [0])
+    moves = array("H")
+    keys = array("Q")
+    for codes, line_keys in replayed:
+        moves.frombytes(codes)
+        keys.frombytes(line_keys)
+        offsets.append(len(moves))
+
+    cache = RepertoireCache(repertoire_fingerprint(openings), lines, offsets, moves, keys, positions)
+    duplicates, prefixes = find_redundant_lines(entries)
+    return cache, sorted(errors), duplicates, prefixes
+
+
+def main(argv=None):
+    from openings import openings
+    from config import REPERTOIRE_CACHE_PATH
+
+    parser = argparse.ArgumentParser(description="Validate the repertoire and write the replayed positions.")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count(), help="worker processes")
+    parser.add_argument("-o", "--output", default=REPERTOIRE_CACHE_PATH, help="position cache to write")
+    args = parser.parse_args(argv)
+
+    cache, errors, duplicates, prefixes = validate(openings, args.jobs)
+
+    for line_id, (ply, uci_move, reason, fen) in errors:
+        line = cache.lines[line_id]
+        print(f"{line.opening} / {line.name}: {reason} {uci_move} at ply {ply + 1} in {fen}")
+    for name, other_name in duplicates:
+        print(f"Duplicate line: {name} has the same moves as {other_name}")
+    for name, other_name in prefixes:
+        print(f"Prefix line: {name} is the start of {other_name}")
+
+    cache.write(args.output)
+    print(f"{len(cache.lines)} lines, {len(cache.moves)} plies, {len(cache.positions)} positions written to {args.output}")
+    print(f"{len(errors)} illegal moves, {len(duplicates)} duplicate lines, {len(prefixes)} prefix lines")
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())